@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""Benchmark install.py against synthetic dotfile repositories and homes.
+
+For every requested size a temporary checkout (a copy of install.py plus
+generated dotfiles) and a home directory with a mix of missing, correct,
+wrong and broken links and pre-existing regular files are created. Stub
+dpkg-query, apt-cache and fc-list executables are put first on PATH and the
+host facts are preset (a plain host without systemd or UI), so no host
+state is read or modified and results do not depend on where the benchmark
+runs. Each measurement runs in a fresh interpreter with HOME pointing at
+the synthetic home.
+
+Results are written as JSON so runs of different commits can be compared:
+
+    python3 benchmarks/bench_install.py --sizes 10,1000,20000 --output bench.json
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple, Union
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCHMARK_DIR.parent
+INSTALL_SCRIPT = REPO_DIR / "install.py"
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+DEFAULT_REPEAT = 3
+# Share of repository files per state of the matching path in HOME.
+DEFAULT_MIX = {
+    "fresh": 0.4,
+    "correct": 0.3,
+    "wrong": 0.1,
+    "broken": 0.1,
+    "regular": 0.1,
+}
+# Share of generated files per dotfile directory; the rest are top-level files.
+DIRECTORY_SHARES = {".config/": 0.6, ".local/bin/": 0.25, ".zsh/": 0.15}
+DPKG_PACKAGES = 3000
+FONT_FAMILIES = 400
+
+STUB_DPKG_QUERY = """#!/bin/sh
+i=0
+while [ $i -lt {count} ]; do
+    printf 'synthetic-pkg-%d\\tii \\n' $i
+    i=$((i + 1))
+done
+for pkg in {installed}; do
+    printf '%s\\tii \\n' "$pkg"
+done
+"""
+
+STUB_APT_CACHE = """#!/bin/sh
+[ "$1" = policy ] || exit 0
+shift
+for pkg in "$@"; do
+    printf '%s:\\n  Installed: (none)\\n  Candidate: 1.0-1\\n' "$pkg"
+done
+"""
+
+STUB_FC_LIST = """#!/bin/sh
+i=0
+while [ $i -lt {count} ]; do
+    printf 'Synthetic Family %d,Synthetic Family %d Nerd Font\\n' $i $i
+    i=$((i + 1))
+done
+printf 'FiraCode Nerd Font,FiraCode Nerd Font Mono\\n'
+"""
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = dict.fromkeys(DEFAULT_MIX, 0.0)
+    for item in value.split(","):
+        state, _, share = item.partition("=")
+        if state not in mix:
+            raise argparse.ArgumentTypeError(
+                "unknown link state '%s' (expected one of %s)"
+                % (state, ", ".join(DEFAULT_MIX))
+            )
+        mix[state] = float(share)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("link state shares must not all be zero")
+    return {state: share / total for state, share in mix.items()}
+
+
+def load_install_module(path: Path):
+    spec = importlib.util.spec_from_file_location("install", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write(path: Path, content: str, executable: bool = False) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+    if executable:
+        path.chmod(0o755)
+
+
+def build_repo(repo: Path, size: int, dotfiles: List[str], use_git: bool) -> List[str]:
+    """Create a checkout with size dotfiles; return their relative paths."""
+    repo.mkdir(parents=True)
+    shutil.copy2(INSTALL_SCRIPT, repo / "install.py")
+
+    files = [dotfile for dotfile in dotfiles if not dotfile.endswith("/")]
+    directories = [dotfile for dotfile in dotfiles if dotfile.endswith("/")]
+    remaining = max(0, size - len(files))
+    for directory in directories:
+        count = int(remaining * DIRECTORY_SHARES.get(directory, 0.0)) or 1
+        for i in range(count):
+            if directory == ".local/bin/":
+                files.append("%sscript-%d" % (directory, i))
+            else:
+                files.append(
+                    "%sapp-%d/sub-%d/file-%d.conf" % (directory, i % 50, i % 7, i)
+                )
+
+    for relative in files:
+        _write(
+            repo / relative,
+            "# synthetic %s\n" % relative,
+            executable=relative.startswith(".local/bin/"),
+        )
+
+    if use_git:
+        git = ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+        for command in (
+            ["init", "-q"],
+            ["add", "-A"],
+            ["commit", "-q", "-m", "synthetic"],
+        ):
+            subprocess.run(
+                git + command, cwd=repo, check=True, stdout=subprocess.DEVNULL
+            )
+    return files
+
+
+def build_home(
+    home: Path,
+    repo: Path,
+    files: List[str],
+    mix: Dict[str, float],
+    extra: int,
+    seed: int,
+) -> Dict[str, int]:
+    """Populate home with link states drawn from mix; return the state counts."""
+    home.mkdir(parents=True)
+    rng = random.Random(seed)
+    states = list(mix)
+    weights = [mix[state] for state in states]
+    counts = dict.fromkeys(states, 0)
+    for relative in files:
+        state = rng.choices(states, weights)[0]
+        counts[state] += 1
+        target = home / relative
+        if state == "fresh":
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if state == "correct":
+            target.symlink_to(repo / relative)
+        elif state == "wrong":
+            target.symlink_to(repo / rng.choice(files))
+        elif state == "broken":
+            target.symlink_to(repo / (relative + ".missing"))
+        else:
+            target.write_text("# local edits\n", encoding="utf-8")
+
+    # Unrelated files of other applications next to the linked ones.
+    for i in range(extra):
+        directory = ".local/bin" if i % 4 == 0 else ".config/other-app-%d" % (i % 100)
+        _write(home / directory / ("unrelated-%d" % i), "# not ours\n")
+    return counts
+
+
+def build_stubs(bin_dir: Path, install) -> None:
+    installed = " ".join(sorted(install.APT_PACKAGES)[::2])
+    _write(
+        bin_dir / "dpkg-query",
+        STUB_DPKG_QUERY.format(count=DPKG_PACKAGES, installed=installed),
+        executable=True,
+    )
+    _write(bin_dir / "apt-cache", STUB_APT_CACHE, executable=True)
+    _write(
+        bin_dir / "fc-list", STUB_FC_LIST.format(count=FONT_FAMILIES), executable=True
+    )
+
+
+def _measure(results: Dict[str, float], name: str, func: Callable[[], object]) -> None:
+    start = time.perf_counter()
+    func()
+    results[name] = time.perf_counter() - start
+
+
+def run_measurements(repo: Path) -> Dict[str, float]:
+    """Time the installer against the synthetic HOME; runs in a fresh interpreter."""
+    logging.basicConfig(level=logging.WARNING)
+    install = load_install_module(repo / "install.py")
+    # Skip the probe (systemctl, /.dockerenv, ...) that get_host_facts() runs.
+    install._host_facts = install.HostFacts(
+        in_container=False,
+        ui_session=False,
+        gnome_shell=False,
+        display_managers=[],
+        previous_installation=False,
+        has_apt=True,
+        has_systemctl=False,
+        user="bench",
+    )
+    results: Dict[str, float] = {}
+
+    _measure(results, "has_previous_installation", install.has_previous_installation)
+    _measure(results, "setup_dotfile_links (cold)", install.setup_dotfile_links)
+    _measure(results, "setup_dotfile_links (warm)", install.setup_dotfile_links)
+    _measure(
+        results,
+        "setup_dotfile_links (verify)",
+        lambda: install.setup_dotfile_links(verify=True),
+    )
+    _measure(
+        results,
+        "has_previous_installation (installed)",
+        install.has_previous_installation,
+    )
+
+    packages = sorted(install.APT_PACKAGES | install.UI_PACKAGES)
+    _measure(
+        results,
+        "classify_apt_packages",
+        lambda: install.classify_apt_packages(packages),
+    )
+    _measure(
+        results,
+        "classify_apt_packages (memoized)",
+        lambda: install.classify_apt_packages(packages),
+    )
+
+    def detect_fonts(use_cache: bool) -> None:
+        index = install.load_font_index(use_cache=use_cache)
+        for family_hints, _ in install.FONT_ZIPS:
+            index.contains(family_hints)
+        if not use_cache:
+            install.save_font_index(index)
+
+    _measure(results, "font detection (cold)", lambda: detect_fonts(False))
+    _measure(results, "font detection (cached index)", lambda: detect_fonts(True))
+    return results
+
+
+def run_scenario(
+    workdir: Path,
+    size: int,
+    mix: Dict[str, float],
+    extra: int,
+    seed: int,
+    use_git: bool,
+    install,
+) -> Tuple[Dict[str, int], Dict[str, float]]:
+    repo = workdir / "repo"
+    home = workdir / "home"
+    bin_dir = workdir / "bin"
+    files = build_repo(repo, size, sorted(install.DOTFILES), use_git)
+    counts = build_home(home, repo, files, mix, extra, seed)
+    build_stubs(bin_dir, install)
+
+    env = dict(os.environ)
+    env["HOME"] = str(home)
+    env["PATH"] = "%s%s%s" % (bin_dir, os.pathsep, env.get("PATH", ""))
+    result = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--measure", str(repo)],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+    )
+    return counts, json.loads(result.stdout)
+
+
+def _git_commit() -> Union[str, None]:
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=REPO_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        encoding="utf-8",
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=DEFAULT_SIZES,
+        help="Comma-separated numbers of dotfiles in the synthetic repository",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="Fresh repository/home pairs per size; results report min and median",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=DEFAULT_MIX,
+        help="Shares of link states in HOME, e.g. 'fresh=0.4,correct=0.3,wrong=0.1,broken=0.1,regular=0.1'",
+    )
+    parser.add_argument(
+        "--extra-files",
+        type=int,
+        default=None,
+        help="Unrelated files under ~/.config and ~/.local/bin (default: same as size)",
+    )
+    parser.add_argument(
+        "--no-git",
+        action="store_true",
+        help="Do not make the synthetic repository a git checkout",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="Write results as JSON to this file instead of stdout",
+    )
+    parser.add_argument("--measure", type=Path, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_arguments()
+    if args.measure:
+        json.dump(run_measurements(args.measure), sys.stdout)
+        return
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s"
+    )
+    install = load_install_module(INSTALL_SCRIPT)
+    use_git = not args.no_git and shutil.which("git") is not None
+    results = []
+    for size in args.sizes:
+        extra = size if args.extra_files is None else args.extra_files
+        runs: Dict[str, List[float]] = {}
+        counts: Dict[str, int] = {}
+        for repetition in range(args.repeat):
+            with tempfile.TemporaryDirectory(prefix="dotfiles-bench-") as workdir:
+                counts, measured = run_scenario(
+                    Path(workdir),
+                    size,
+                    args.mix,
+                    extra,
+                    args.seed + repetition,
+                    use_git,
+                    install,
+                )
+            for name, seconds in measured.items():
+                runs.setdefault(name, []).append(seconds)
+        for name, seconds in runs.items():
+            logging.info(
+                "size %6d  %-40s min %8.4fs  median %8.4fs",
+                size,
+                name,
+                min(seconds),
+                statistics.median(seconds),
+            )
+            results.append(
+                {
+                    "size": size,
+                    "extra_files": extra,
+                    "link_states": counts,
+                    "benchmark": name,
+                    "min": min(seconds),
+                    "median": statistics.median(seconds),
+                    "runs": seconds,
+                }
+            )
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "git_checkout": use_git,
+        "mix": args.mix,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        logging.info("Wrote results to '%s'", args.output)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
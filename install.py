@@ -1,26 +1,75 @@
 #!/usr/bin/env python3
 import argparse
+import fcntl
+import fnmatch
+import getpass
+import gzip
+import hashlib
 import importlib.util
 import io
+import json
 import logging
 import os
 from pathlib import Path
+import platform
+import re
 import shutil
+import site
+import stat
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
+import time
 import zipfile
+import zlib
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Set, Tuple, Union
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Set,
+    Tuple,
+    Union,
+)
 from urllib.parse import unquote
 
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 HOME_DIR = Path.home().resolve()
-BACKUP_DIR = HOME_DIR / ".dotfiles-backup" / timestamp
-INSTALLER_VENV_DIR = HOME_DIR / ".local" / "share" / "dotfiles-installer" / "venv"
+BACKUP_ROOT = HOME_DIR / ".dotfiles-backup"
+BACKUP_RUN = timestamp
+BACKUP_MANIFEST_VERSION = 1
+BACKUP_KEEP_RUNS = 30
+# Loose blobs are packed into one compressed archive once there are this many.
+BACKUP_PACK_THRESHOLD = 64
+# Per-run directories written by older versions: ~/.dotfiles-backup/<timestamp>/
+LEGACY_BACKUP_RUN_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$")
+INSTALLER_STATE_DIR = HOME_DIR / ".local" / "share" / "dotfiles-installer"
+INSTALLER_VENV_DIR = INSTALLER_STATE_DIR / "venv"
+INSTALLER_VENV_FINGERPRINT_PATH = INSTALLER_VENV_DIR / ".installer-fingerprint"
+LINK_MANIFEST_PATH = INSTALLER_STATE_DIR / "link-manifest.json"
+LINK_MANIFEST_VERSION = 1
+LINK_JOURNAL_PATH = INSTALLER_STATE_DIR / "link-journal.jsonl"
+HOST_FACTS_PATH = INSTALLER_STATE_DIR / "host-facts.json"
+# Touched after each successful 'apt-get update' run by the installer
+APT_UPDATE_STAMP_PATH = INSTALLER_STATE_DIR / "apt-update-stamp"
 INSTALLER_REQUIRED_PACKAGES = {"requests"}
+WHEELHOUSE_REQUIREMENTS = "requirements.txt"
 
 DOTFILES = {
     ".bashrc",
@@ -37,6 +86,8 @@ DOTFILES = {
 
 PATHS_IGNORED_IN_DOCKER = {".gitconfig"}
 
+DISPLAY_MANAGERS = ["gdm", "gdm3", "lightdm", "sddm"]
+
 # Packages needed for a working zsh environment.
 # Used both on the host and inside containers.
 APT_ZSH_PACKAGES = {
@@ -68,6 +119,38 @@ APT_HOST_PACKAGES = {
 
 APT_PACKAGES = APT_ZSH_PACKAGES | APT_HOST_PACKAGES
 
+# Package lists younger than this are trusted when planning installs; older
+# lists trigger 'apt-get update' first.
+APT_LISTS_DIR = Path("/var/lib/apt/lists")
+APT_LISTS_MAX_AGE_HOURS = 24.0
+# A package without install candidate only triggers a refresh of lists older
+# than this; one that is missing from the distro would refresh every run.
+APT_LISTS_MIN_REFRESH_HOURS = 1.0
+# .debs of the zsh package closure, built on the host with --build-apt-bundle
+# so containers can install them without apt-get update or network access.
+APT_BUNDLE_DIR = Path(
+    os.environ.get(
+        "DOTFILES_APT_BUNDLE",
+        HOME_DIR / ".cache" / "dotfiles-installer" / "apt-bundle",
+    )
+)
+APT_BUNDLE_SEARCH_DIRS = [
+    APT_BUNDLE_DIR,
+    # the host home as mounted into dev containers
+    Path("/mnt/host_home") / ".cache" / "dotfiles-installer" / "apt-bundle",
+]
+# Archive of a set-up home (--export-snapshot) that containers unpack instead
+# of running the setup. Its manifest lives in the home root, as the installer
+# state directory may be a volume that outlives the home.
+HOME_SNAPSHOT_PATH = Path(
+    os.environ.get(
+        "DOTFILES_SNAPSHOT",
+        Path("/mnt/host_home") / ".cache" / "dotfiles-installer" / "home-snapshot.tar",
+    )
+)
+HOME_SNAPSHOT_MANIFEST = ".dotfiles-snapshot.json"
+HOME_SNAPSHOT_VERSION = 1
+
 # UI-dependent packages that should be skipped in headless mode
 UI_PACKAGES = {
     "flameshot",
@@ -79,6 +162,224 @@ UI_PACKAGES = {
     "guake-indicator",
 }
 
+FONT_DIR = HOME_DIR / ".local" / "share" / "fonts"
+FONT_DOWNLOAD_WORKERS = 4
+FONT_SUFFIXES = (".ttf", ".otf", ".ttc")
+FONT_INDEX_PATH = INSTALLER_STATE_DIR / "font-index.json"
+# Directories fontconfig scans by default; their mtimes key the font index.
+FONT_SEARCH_DIRS = [
+    Path("/usr/share/fonts"),
+    Path("/usr/local/share/fonts"),
+    FONT_DIR,
+    HOME_DIR / ".fonts",
+]
+# Archive members matching any of these globs are never installed, e.g. the
+# "Windows Compatible" duplicates shipped in every Nerd Fonts zip.
+FONT_MEMBER_EXCLUDES = ["*Windows Compatible*"]
+# If non-empty, only archive members matching one of these globs are
+# installed (e.g. ["*Regular*", "*Bold*"]); see --font-variant.
+FONT_MEMBER_INCLUDES: List[str] = []
+
+# Downloaded fonts and binaries are kept in a content-addressed cache that can
+# be shared between hosts (e.g. a mounted directory) via DOTFILES_DOWNLOAD_CACHE.
+DOWNLOAD_CACHE_DIR = Path(
+    os.environ.get(
+        "DOTFILES_DOWNLOAD_CACHE",
+        HOME_DIR / ".cache" / "dotfiles-installer" / "downloads",
+    )
+)
+DOWNLOAD_CACHE_MAX_BYTES = 1 << 30
+
+STARSHIP_RELEASE_URL = "https://github.com/starship/starship/releases/latest/download"
+STARSHIP_ARCHIVES = {
+    "x86_64": "starship-x86_64-unknown-linux-musl.tar.gz",
+    "aarch64": "starship-aarch64-unknown-linux-musl.tar.gz",
+}
+
+# (family hints as reported by fc-list, download URL)
+FONT_ZIPS = [
+    (
+        ["firacode", "fira code"],
+        "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/FiraCode.zip",
+    ),
+    (
+        ["robotomono", "roboto mono"],
+        "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/RobotoMono.zip",
+    ),
+    (
+        ["sourcecodepro", "source code pro", "saucecodepro"],
+        "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/SourceCodePro.zip",
+    ),
+    (
+        ["hack"],
+        "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/Hack.zip",
+    ),
+    (
+        ["meslolgs", "meslo lgs"],
+        "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/Meslo.zip",
+    ),
+]
+FONT_FILES = [
+    "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Regular.ttf",
+    "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Bold.ttf",
+    "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Italic.ttf",
+    "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Bold%20Italic.ttf",
+]
+
+
+_runtime_environment_lock = threading.Lock()
+
+# Wall-clock timings of phases and of the I/O-heavy steps inside them
+# (subprocesses, downloads, ...), reported at the end of a run.
+TIMINGS: List[dict] = []
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def timed(name: str, kind: str = "step") -> Iterator[None]:
+    started_at = time.time()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        entry = {
+            "name": name,
+            "kind": kind,
+            "start": started_at,
+            "seconds": time.monotonic() - start,
+        }
+        with _timings_lock:
+            TIMINGS.append(entry)
+
+
+class CommandRunner:
+    """Single entry point for external commands and executable lookups.
+
+    Every call is recorded into a trace (argv, cwd, duration, exit code,
+    output). With a replay trace loaded, recorded results are served back
+    instead of touching the host, so a captured host profile can be run
+    without dpkg, apt, systemctl or fc-list.
+    """
+
+    def __init__(self) -> None:
+        self.trace: List[dict] = []
+        self._replay: Union[Dict[str, List[dict]], None] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(kind: str, command: Union[List[str], str], cwd: Union[str, None]) -> str:
+        return json.dumps([kind, command, cwd])
+
+    def load_replay(self, path: Path) -> None:
+        with open(path, "r", encoding="utf-8") as file:
+            entries = json.load(file)["commands"]
+        replay: Dict[str, List[dict]] = {}
+        for entry in entries:
+            if "which" in entry:
+                key = self._key("which", entry["which"], None)
+            else:
+                key = self._key("run", entry["argv"], entry["cwd"])
+            replay.setdefault(key, []).append(entry)
+        self._replay = replay
+
+    def _replayed(self, key: str) -> Union[dict, None]:
+        # Repeated commands get the recorded results in order; the last
+        # one keeps being served once they are used up.
+        with self._lock:
+            entries = self._replay.get(key) if self._replay is not None else None
+            if not entries:
+                return None
+            return entries.pop(0) if len(entries) > 1 else entries[0]
+
+    def _record(self, entry: dict) -> None:
+        with self._lock:
+            self.trace.append(entry)
+
+    def which(self, name: str) -> Union[str, None]:
+        if self._replay is not None:
+            replayed = self._replayed(self._key("which", name, None))
+            path = replayed["path"] if replayed is not None else None
+        else:
+            path = shutil.which(name)
+        self._record({"which": name, "path": path})
+        return path
+
+    def run(
+        self,
+        command: Union[List[str], str],
+        check: bool = False,
+        cwd: Union[Path, None] = None,
+        shell: bool = False,
+    ) -> subprocess.CompletedProcess:
+        command = command if shell else [str(arg) for arg in command]
+        cwd_str = str(cwd) if cwd is not None else None
+        started_at = time.time()
+        start = time.monotonic()
+        if self._replay is not None:
+            replayed = self._replayed(self._key("run", command, cwd_str))
+            if replayed is None:
+                logging.debug(
+                    "Replay: no recording for %s; reporting exit code 127", command
+                )
+                replayed = {"returncode": 127, "stdout": "", "stderr": "not recorded\n"}
+            result = subprocess.CompletedProcess(
+                command, replayed["returncode"], replayed["stdout"], replayed["stderr"]
+            )
+        else:
+            result = subprocess.run(
+                command,
+                cwd=cwd,
+                shell=shell,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                encoding="utf-8",
+                errors="replace",
+            )
+        self._record(
+            {
+                "argv": command,
+                "cwd": cwd_str,
+                "start": started_at,
+                "seconds": time.monotonic() - start,
+                "returncode": result.returncode,
+                "stdout_bytes": len(result.stdout.encode("utf-8")),
+                "stderr_bytes": len(result.stderr.encode("utf-8")),
+                "stdout": result.stdout,
+                "stderr": result.stderr,
+            }
+        )
+        if check:
+            result.check_returncode()
+        return result
+
+    def write_trace(self, path: Path) -> None:
+        with self._lock:
+            data = {"commands": list(self.trace)}
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(data, file, indent=2)
+        except OSError as exc:
+            logging.warning("Failed to write command trace to '%s': %s", path, exc)
+            return
+        logging.info("Wrote command trace to '%s'", path)
+
+
+COMMANDS = CommandRunner()
+
+
+def run_command(
+    command: Union[List[str], str],
+    check: bool = False,
+    cwd: Union[Path, None] = None,
+    shell: bool = False,
+) -> subprocess.CompletedProcess:
+    """Run a command with captured text output, through the traced runner."""
+    return COMMANDS.run(command, check=check, cwd=cwd, shell=shell)
+
+
+def which(name: str) -> Union[str, None]:
+    return COMMANDS.which(name)
+
 
 def _module_available(module_name: str) -> bool:
     return importlib.util.find_spec(module_name) is not None
@@ -95,6 +396,46 @@ def _format_subprocess_error(cpe: subprocess.CalledProcessError) -> str:
     return f"exit code {cpe.returncode}; output: {output}"
 
 
+def _installer_venv_fingerprint() -> str:
+    """Identify what the installer venv was built for.
+
+    A venv is tied to the interpreter that created it, and its content to
+    INSTALLER_REQUIRED_PACKAGES and the pinned wheelhouse (if one is used);
+    if any of these changes, the venv is rebuilt.
+    """
+    wheelhouse = installer_wheelhouse()
+    data = {
+        "python": sys.version,
+        "executable": os.path.realpath(sys.executable),
+        "packages": sorted(INSTALLER_REQUIRED_PACKAGES),
+        "wheelhouse": (
+            hashlib.sha256(
+                (wheelhouse / WHEELHOUSE_REQUIREMENTS).read_bytes()
+            ).hexdigest()
+            if wheelhouse is not None
+            else None
+        ),
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def _read_installer_venv_fingerprint() -> Union[str, None]:
+    try:
+        return INSTALLER_VENV_FINGERPRINT_PATH.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+
+def _write_installer_venv_fingerprint(fingerprint: str) -> None:
+    try:
+        INSTALLER_VENV_FINGERPRINT_PATH.write_text(fingerprint + "\n", encoding="utf-8")
+    except OSError as exc:
+        print(
+            f"Failed to record installer venv fingerprint: {exc}",
+            file=sys.stderr,
+        )
+
+
 def _reset_installer_venv_dir() -> None:
     if INSTALLER_VENV_DIR.exists():
         try:
@@ -109,7 +450,7 @@ def _reset_installer_venv_dir() -> None:
 
 
 def _try_install_python_bootstrap_with_apt() -> bool:
-    apt_get = shutil.which("apt-get")
+    apt_get = which("apt-get")
     if apt_get is None:
         return False
 
@@ -117,7 +458,7 @@ def _try_install_python_bootstrap_with_apt() -> bool:
         update_command = [apt_get, "update"]
         install_command = [apt_get, "install", "-y", "python3-venv", "python3-pip"]
     else:
-        sudo = shutil.which("sudo")
+        sudo = which("sudo")
         if sudo is None:
             print(
                 "python3-venv/python3-pip are required but 'sudo' is not available for apt install.",
@@ -135,19 +476,13 @@ def _try_install_python_bootstrap_with_apt() -> bool:
         ]
 
     try:
-        subprocess.run(
+        run_command(
             update_command,
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
         )
-        subprocess.run(
+        run_command(
             install_command,
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
         )
         return True
     except subprocess.CalledProcessError as cpe:
@@ -161,44 +496,260 @@ def _try_install_python_bootstrap_with_apt() -> bool:
 
 def _venv_has_pip(venv_python: Path) -> bool:
     try:
-        subprocess.run(
+        run_command(
             [str(venv_python), "-m", "pip", "--version"],
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
         )
         return True
     except subprocess.CalledProcessError:
         return False
 
 
+def _missing_installer_packages() -> List[str]:
+    return sorted(
+        pkg for pkg in INSTALLER_REQUIRED_PACKAGES if not _module_available(pkg)
+    )
+
+
+def _activate_installer_venv() -> None:
+    """Make the venv's packages importable in this interpreter.
+
+    The venv is created by (and fingerprinted against) the running
+    interpreter, so its site-packages can be used directly; no re-exec.
+    """
+    version = "python%d.%d" % sys.version_info[:2]
+    site_packages = str(INSTALLER_VENV_DIR / "lib" / version / "site-packages")
+    # addsitedir() appends, which would let system dist-packages (e.g. an old
+    # urllib3) shadow the venv's pinned packages; move the new entries first.
+    previous_path = list(sys.path)
+    site.addsitedir(site_packages)
+    added = [path for path in sys.path if path not in previous_path]
+    sys.path[:] = added + previous_path
+    # Forget modules imported from elsewhere that the venv provides, so the
+    # next import picks up the venv copy.
+    try:
+        provided = {
+            name[:-3] if name.endswith(".py") else name
+            for name in os.listdir(site_packages)
+        }
+    except OSError:
+        provided = set()
+    for name, module in list(sys.modules.items()):
+        origin = getattr(module, "__file__", None) or ""
+        if name.partition(".")[0] in provided and not origin.startswith(site_packages):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
 def ensure_runtime_environment() -> None:
-    """Run installer from dedicated venv and ensure required Python deps exist.
+    """Make INSTALLER_REQUIRED_PACKAGES importable, bootstrapping a venv if needed.
+
+    Only phases that need third-party packages (network downloads) call this,
+    so plain relinks and container starts run on the system Python alone.
 
     Many modern distros block system/user pip installs (PEP 668). To keep setup
-    reproducible we bootstrap a private venv and re-exec the installer there.
+    reproducible we bootstrap a private venv and add its site-packages to the
+    running interpreter.
     """
-    in_bootstrap = os.environ.get("DOTFILES_INSTALLER_VENV_ACTIVE") == "1"
-    missing_packages = [
-        pkg for pkg in INSTALLER_REQUIRED_PACKAGES if not _module_available(pkg)
-    ]
-    if not missing_packages and in_bootstrap:
+    with _runtime_environment_lock, timed("venv bootstrap"):
+        _ensure_runtime_environment()
+
+
+def _ensure_runtime_environment() -> None:
+    if not _missing_installer_packages():
         return
 
     venv_python = _installer_venv_python()
+    fingerprint = _installer_venv_fingerprint()
+    recorded_fingerprint = _read_installer_venv_fingerprint()
+
+    if venv_python.exists() and recorded_fingerprint == fingerprint:
+        # Warm run: the venv was built for this interpreter and package set,
+        # so skip pip entirely.
+        _activate_installer_venv()
+        if not _missing_installer_packages():
+            return
+        # Fingerprint matches, but the packages are not importable from the
+        # venv; rebuild it from scratch below.
+        recorded_fingerprint = None
+
+    if venv_python.exists() and recorded_fingerprint != fingerprint:
+        print(
+            "Installer venv does not match this interpreter/package set; rebuilding it.",
+            file=sys.stderr,
+        )
+        _reset_installer_venv_dir()
+
+    wheelhouse = installer_wheelhouse()
+    if wheelhouse is not None:
+        _build_installer_venv_from_wheelhouse(wheelhouse)
+    else:
+        _build_installer_venv_from_index()
+
+    _write_installer_venv_fingerprint(fingerprint)
+
+    _activate_installer_venv()
+    missing_packages = _missing_installer_packages()
+    if missing_packages:
+        print(
+            "Installer dependencies are still not importable after bootstrapping "
+            f"'{INSTALLER_VENV_DIR}': {', '.join(missing_packages)}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def installer_wheelhouse() -> Union[Path, None]:
+    """Return the local wheelhouse to build the venv from, if there is one.
+
+    DOTFILES_INSTALLER_WHEELHOUSE takes precedence over the wheelhouse/
+    directory bundled next to this script. A wheelhouse is only used if it
+    contains the hash-pinned requirements file written by --build-wheelhouse.
+    """
+    configured = os.environ.get("DOTFILES_INSTALLER_WHEELHOUSE")
+    wheelhouse = Path(configured) if configured else SCRIPT_DIR / "wheelhouse"
+    if (wheelhouse / WHEELHOUSE_REQUIREMENTS).is_file():
+        return wheelhouse
+    if configured:
+        print(
+            f"Ignoring wheelhouse '{wheelhouse}': no {WHEELHOUSE_REQUIREMENTS} found.",
+            file=sys.stderr,
+        )
+    return None
+
+
+def _wheelhouse_pip_wheel(wheelhouse: Path) -> Union[Path, None]:
+    """The pip wheel pinned in the wheelhouse requirements, if its hash matches.
+
+    pip runs from this wheel before it can check any hashes itself.
+    """
+    try:
+        lines = (wheelhouse / WHEELHOUSE_REQUIREMENTS).read_text(encoding="utf-8")
+    except OSError:
+        return None
+    pins = [
+        line.split()
+        for line in lines.splitlines()
+        if line.startswith("pip==") and " --hash=sha256:" in line
+    ]
+    if len(pins) != 1:
+        return None
+    version = pins[0][0].partition("==")[2]
+    digest = pins[0][1].partition(":")[2]
+    wheels = list(wheelhouse.glob("pip-%s-*.whl" % version))
+    if len(wheels) != 1:
+        return None
+    if hashlib.sha256(wheels[0].read_bytes()).hexdigest() != digest:
+        return None
+    return wheels[0]
+
+
+def _build_installer_venv_from_wheelhouse(wheelhouse: Path) -> None:
+    """Create the venv and install pinned wheels without any index access.
+
+    The venv is created without ensurepip and pip runs straight from the pip
+    wheel in the wheelhouse, so neither python3-pip nor apt is required.
+    """
+    venv_python = _installer_venv_python()
+    pip_wheel = _wheelhouse_pip_wheel(wheelhouse)
+    if pip_wheel is None:
+        print(
+            f"Wheelhouse '{wheelhouse}' does not contain the pinned pip wheel; "
+            "rebuild it with --build-wheelhouse.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    _reset_installer_venv_dir()
+    try:
+        run_command(
+            [sys.executable, "-m", "venv", "--without-pip", str(INSTALLER_VENV_DIR)],
+            check=True,
+        )
+        run_command(
+            [
+                str(venv_python),
+                str(pip_wheel / "pip"),
+                "install",
+                "--no-index",
+                "--find-links",
+                str(wheelhouse),
+                "--only-binary",
+                ":all:",
+                "--require-hashes",
+                "-r",
+                str(wheelhouse / WHEELHOUSE_REQUIREMENTS),
+            ],
+            check=True,
+        )
+    except subprocess.CalledProcessError as cpe:
+        print(
+            f"Failed to build installer venv from wheelhouse '{wheelhouse}'.\n"
+            f"Details: {_format_subprocess_error(cpe)}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+def build_wheelhouse(destination: Path) -> None:
+    """Download pip and INSTALLER_REQUIRED_PACKAGES (with dependencies) as wheels.
+
+    Writes a requirements file pinning every wheel to its version and sha256,
+    so the venv can later be built from this directory with no index access.
+    """
+    venv_python = _installer_venv_python()
+    python = str(venv_python) if venv_python.exists() else sys.executable
+    destination.mkdir(parents=True, exist_ok=True)
+    requirements = []
+    with tempfile.TemporaryDirectory() as download_dir:
+        try:
+            run_command(
+                [
+                    python,
+                    "-m",
+                    "pip",
+                    "download",
+                    "--only-binary",
+                    ":all:",
+                    "--dest",
+                    download_dir,
+                    "pip",
+                    *sorted(INSTALLER_REQUIRED_PACKAGES),
+                ],
+                check=True,
+            )
+        except subprocess.CalledProcessError as cpe:
+            logging.error(
+                "Failed to download wheels: %s", _format_subprocess_error(cpe)
+            )
+            sys.exit(1)
+        for wheel in sorted(Path(download_dir).glob("*.whl")):
+            name, version = wheel.name.split("-")[:2]
+            digest = hashlib.sha256(wheel.read_bytes()).hexdigest()
+            requirements.append(f"{name}=={version} --hash=sha256:{digest}")
+            shutil.copyfile(wheel, destination / wheel.name)
+    (destination / WHEELHOUSE_REQUIREMENTS).write_text(
+        "\n".join(requirements) + "\n", encoding="utf-8"
+    )
+    logging.info(
+        "Wrote %d hash-pinned wheels to wheelhouse '%s'", len(requirements), destination
+    )
+
 
+def _build_installer_venv_from_index() -> None:
+    """Create the venv with ensurepip and install packages from the package index.
+
+    Falls back to installing python3-venv/python3-pip via apt if needed.
+    """
+    venv_python = _installer_venv_python()
     if not venv_python.exists():
         _reset_installer_venv_dir()
 
         venv_creation_error: Union[subprocess.CalledProcessError, None] = None
         try:
-            subprocess.run(
+            run_command(
                 [sys.executable, "-m", "venv", str(INSTALLER_VENV_DIR)],
                 check=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                encoding="utf-8",
             )
         except subprocess.CalledProcessError as cpe:
             venv_creation_error = cpe
@@ -211,12 +762,9 @@ def ensure_runtime_environment() -> None:
             if _try_install_python_bootstrap_with_apt():
                 _reset_installer_venv_dir()
                 try:
-                    subprocess.run(
+                    run_command(
                         [sys.executable, "-m", "venv", str(INSTALLER_VENV_DIR)],
                         check=True,
-                        stderr=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        encoding="utf-8",
                     )
                     venv_creation_error = None
                 except subprocess.CalledProcessError as cpe:
@@ -247,12 +795,9 @@ def ensure_runtime_environment() -> None:
         if _try_install_python_bootstrap_with_apt():
             _reset_installer_venv_dir()
             try:
-                subprocess.run(
+                run_command(
                     [sys.executable, "-m", "venv", str(INSTALLER_VENV_DIR)],
                     check=True,
-                    stderr=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    encoding="utf-8",
                 )
             except subprocess.CalledProcessError as cpe:
                 print(
@@ -273,20 +818,14 @@ def ensure_runtime_environment() -> None:
         sys.exit(1)
 
     try:
-        subprocess.run(
+        run_command(
             [str(venv_python), "-m", "pip", "install", "--upgrade", "pip"],
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
         )
-        subprocess.run(
+        run_command(
             [str(venv_python), "-m", "pip", "install"]
             + list(INSTALLER_REQUIRED_PACKAGES),
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
         )
     except subprocess.CalledProcessError as cpe:
         print(
@@ -296,13 +835,6 @@ def ensure_runtime_environment() -> None:
         )
         sys.exit(1)
 
-    # Re-exec under dedicated installer interpreter exactly once.
-    if not in_bootstrap or missing_packages:
-        env = os.environ.copy()
-        env["DOTFILES_INSTALLER_VENV_ACTIVE"] = "1"
-        result = subprocess.run([str(venv_python), __file__, *sys.argv[1:]], env=env)
-        sys.exit(result.returncode)
-
 
 def get_dotfiles_path(relative_path: Union[str, Path]) -> Path:
     return SCRIPT_DIR / relative_path
@@ -326,74 +858,665 @@ def verify_dotfiles_exist() -> None:
     logging.info("All required dotfiles are present")
 
 
+# Actions produced by the link planner. Each planned entry is applied
+# independently, which is what allows the apply phase to run in parallel.
+LINK_ACTION_KEEP = "keep"  # correct link (or the file itself) already in place
+LINK_ACTION_CREATE = "create"  # nothing at the target yet
+LINK_ACTION_BACKUP = "backup"  # real file/dir at the target: back up, then link
+LINK_ACTION_REPLACE = "replace"  # wrong/broken link or leftover: remove, then link
+
+# Link planning and applying is dominated by metadata round-trips (stat,
+# readlink, rename, ...), so threads help a lot on network home directories.
+LINK_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+class PlannedLink(NamedTuple):
+    target: Path
+    source: Path
+    action: str
+
+
+class StatCache:
+    """Per-run cache of lstat results and resolved paths for the link phase.
+
+    Every path is lstat'ed at most once and directories are resolved once for
+    all files below them, instead of each Path.exists()/is_symlink()/resolve()
+    going back to the (possibly network) filesystem. The number of actual
+    filesystem calls is counted for the debug log.
+    """
+
+    def __init__(self) -> None:
+        self._lstats: Dict[str, Union[os.stat_result, None]] = {}
+        self._realpaths: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def count(self, call: str, n: int = 1) -> None:
+        with self._lock:
+            self.calls[call] = self.calls.get(call, 0) + n
+
+    def invalidate(self, path: Union[Path, str]) -> None:
+        self._lstats.pop(str(path), None)
+        self._realpaths.pop(str(path), None)
+
+    def lstat(self, path: Union[Path, str]) -> Union[os.stat_result, None]:
+        path = str(path)
+        try:
+            return self._lstats[path]
+        except KeyError:
+            pass
+        self.count("lstat")
+        try:
+            stat_result: Union[os.stat_result, None] = os.lstat(path)
+        except OSError:
+            stat_result = None
+        self._lstats[path] = stat_result
+        return stat_result
+
+    def is_symlink(self, path: Union[Path, str]) -> bool:
+        stat_result = self.lstat(path)
+        return stat_result is not None and stat.S_ISLNK(stat_result.st_mode)
+
+    def stat(self, path: Union[Path, str]) -> Union[os.stat_result, None]:
+        """stat() following symlinks; only links need a second call."""
+        stat_result = self.lstat(path)
+        if stat_result is None or not stat.S_ISLNK(stat_result.st_mode):
+            return stat_result
+        self.count("stat")
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+
+    def realpath(self, path: Union[Path, str]) -> str:
+        """Like Path.resolve(), reusing the resolved parent directories."""
+        path = str(path)
+        try:
+            return self._realpaths[path]
+        except KeyError:
+            pass
+        parent, name = os.path.split(path)
+        if not name or parent == path:
+            return path
+        candidate = os.path.join(self.realpath(parent), name)
+        if self.is_symlink(candidate):
+            self.count("realpath")
+            resolved = os.path.realpath(candidate)
+        else:
+            resolved = candidate
+        self._realpaths[path] = resolved
+        return resolved
+
+    def scan_files(self, directory: str) -> Iterator[str]:
+        """Yield every non-directory below directory, without following links.
+
+        Symlinked subdirectories are neither descended into nor yielded, like
+        os.walk(followlinks=False) does.
+        """
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            self.count("scandir")
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.is_symlink() and entry.is_dir():
+                            continue
+                        else:
+                            yield entry.path
+            except OSError as exc:
+                logging.warning("Cannot scan directory '%s': %s", current, exc)
+
+    def log_calls(self, label: str) -> None:
+        logging.debug(
+            "%s: filesystem calls %s (%d paths cached)",
+            label,
+            ", ".join("%s=%d" % item for item in sorted(self.calls.items())) or "none",
+            len(self._lstats),
+        )
+
+
+class LinkJournal:
+    """Append-only log of the link operations of a run.
+
+    Every operation is written (and flushed) before it is applied and marked
+    done afterwards, so after an interrupted run the next one only has to
+    finish the operations that were begun but not done.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, op: str, **fields) -> None:
+        line = json.dumps({"op": op, **fields}) + "\n"
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(
+                    json.dumps({"op": "run", "run": BACKUP_RUN, "pid": os.getpid()})
+                    + "\n"
+                )
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        """Close and drop the journal once the run's results are recorded."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def read(path: Path) -> List[dict]:
+        records = []
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # torn last line of a killed run
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+
+class BackupStore:
+    """Content-addressed store for files displaced by the link phase.
+
+    Layout below BACKUP_ROOT:
+      objects/ab/abcd...   one loose blob per unique file content (sha256)
+      packs/*.zip          deflate-compressed blobs, one member per sha256
+      runs/<run>.json      per-run manifest: relative path -> blob/symlink/dir
+
+    Identical files backed up by many runs are stored once. Old runs are
+    dropped by a retention policy, after which unreferenced blobs are
+    garbage-collected and loose blobs are packed.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        run: Union[str, None] = None,
+        journal: Union[LinkJournal, None] = None,
+    ) -> None:
+        self.root = root
+        self.run = run
+        self.journal = journal
+        self.entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._packed: Union[Dict[str, Path], None] = None
+
+    @property
+    def objects_dir(self) -> Path:
+        return self.root / "objects"
+
+    @property
+    def packs_dir(self) -> Path:
+        return self.root / "packs"
+
+    @property
+    def runs_dir(self) -> Path:
+        return self.root / "runs"
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+    def _pack_index(self) -> Dict[str, Path]:
+        """Map of sha256 -> pack, read from the zip central directories once."""
+        if self._packed is None:
+            packed: Dict[str, Path] = {}
+            for pack in sorted(self.packs_dir.glob("*.zip")):
+                try:
+                    with zipfile.ZipFile(pack) as archive:
+                        packed.update(dict.fromkeys(archive.namelist(), pack))
+                except (OSError, zipfile.BadZipFile) as exc:
+                    logging.warning(
+                        "Ignoring unreadable backup pack '%s': %s", pack, exc
+                    )
+            self._packed = packed
+        return self._packed
+
+    def has_blob(self, digest: str) -> bool:
+        return self._blob_path(digest).exists() or digest in self._pack_index()
+
+    def _store_blob(self, source: Path) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        with open(source, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                digest.update(chunk)
+                size += len(chunk)
+        sha = digest.hexdigest()
+        if not self.has_blob(sha):
+            blob_path = self._blob_path(sha)
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_name(
+                "%s.%d.%d.tmp" % (sha, os.getpid(), threading.get_ident())
+            )
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, blob_path)
+        return sha, size
+
+    def add(self, path: Path, relative_path: str) -> int:
+        """Record path (file, symlink or directory tree) under relative_path.
+
+        Returns the number of entries recorded.
+        """
+        entries: Dict[str, dict] = {}
+        pending = [(str(path), relative_path)]
+        while pending:
+            current, relative = pending.pop()
+            stat_result = os.lstat(current)
+            if stat.S_ISLNK(stat_result.st_mode):
+                entries[relative] = {"type": "symlink", "target": os.readlink(current)}
+            elif stat.S_ISDIR(stat_result.st_mode):
+                entries[relative] = {
+                    "type": "dir",
+                    "mode": stat.S_IMODE(stat_result.st_mode),
+                }
+                with os.scandir(current) as children:
+                    pending.extend(
+                        (child.path, relative + "/" + child.name) for child in children
+                    )
+            elif stat.S_ISREG(stat_result.st_mode):
+                sha, size = self._store_blob(Path(current))
+                entries[relative] = {
+                    "type": "file",
+                    "blob": sha,
+                    "size": size,
+                    "mode": stat.S_IMODE(stat_result.st_mode),
+                }
+        if self.journal is not None:
+            # The blobs are stored; the run manifest is only written at the end.
+            self.journal.record("backup", run=self.run, entries=entries)
+        with self._lock:
+            self.entries.update(entries)
+        return len(entries)
+
+    def contains(self, relative_path: str) -> bool:
+        with self._lock:
+            return relative_path in self.entries
+
+    def finish(self) -> Union[Path, None]:
+        """Write the manifest of this run; None if nothing was backed up.
+
+        Entries already recorded for the same run (by the recovery of an
+        interrupted run) are kept.
+        """
+        if not self.entries:
+            return None
+        manifest_path = self.runs_dir / ("%s.json" % self.run)
+        try:
+            self.entries = {**self.load_run(self.run)["entries"], **self.entries}
+        except (OSError, ValueError, KeyError):
+            pass
+        data = {
+            "version": BACKUP_MANIFEST_VERSION,
+            "run": self.run,
+            "home": str(HOME_DIR),
+            "entries": self.entries,
+        }
+        self.runs_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+        logging.info(
+            "Backed up %d entries to '%s' (run %s)",
+            len(self.entries),
+            self.root,
+            self.run,
+        )
+        return manifest_path
+
+    def runs(self) -> List[str]:
+        """Recorded runs, oldest first (run ids are sortable timestamps)."""
+        return sorted(path.stem for path in self.runs_dir.glob("*.json"))
+
+    def load_run(self, run: str) -> dict:
+        with open(self.runs_dir / ("%s.json" % run), "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def read_blobs(self, digests: Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+        """Yield (sha, content) for digests, opening every pack at most once."""
+        by_pack: Dict[Path, List[str]] = {}
+        for digest in sorted(set(digests)):
+            blob_path = self._blob_path(digest)
+            if blob_path.exists():
+                yield digest, blob_path.read_bytes()
+            elif digest in self._pack_index():
+                by_pack.setdefault(self._pack_index()[digest], []).append(digest)
+            else:
+                raise FileNotFoundError("backup blob %s is missing" % digest)
+        for pack, members in by_pack.items():
+            with zipfile.ZipFile(pack) as archive:
+                for digest in members:
+                    yield digest, archive.read(digest)
+
+    def import_legacy_runs(self) -> int:
+        """Fold old '<timestamp>/' backup trees into the store as runs."""
+        imported = 0
+        for legacy_dir in sorted(self.root.iterdir()):
+            if (
+                not LEGACY_BACKUP_RUN_PATTERN.match(legacy_dir.name)
+                or not legacy_dir.is_dir()
+            ):
+                continue
+            legacy = BackupStore(self.root, legacy_dir.name)
+            legacy._packed = self._packed
+            for child in legacy_dir.iterdir():
+                legacy.add(child, child.name)
+            legacy.finish()
+            shutil.rmtree(legacy_dir)
+            imported += 1
+        if imported:
+            logging.info(
+                "Imported %d legacy backup directories into '%s'", imported, self.root
+            )
+        return imported
+
+    def maintain(self, keep_runs: int) -> None:
+        """Apply retention, drop unreferenced blobs and pack loose blobs."""
+        runs = self.runs()
+        for run in runs[: max(0, len(runs) - keep_runs)]:
+            logging.info(
+                "Removing backup run '%s' (keeping the last %d)", run, keep_runs
+            )
+            (self.runs_dir / ("%s.json" % run)).unlink()
+        referenced: Set[str] = set()
+        for run in self.runs():
+            entries = self.load_run(run).get("entries", {})
+            referenced.update(
+                entry["blob"]
+                for entry in entries.values()
+                if entry.get("type") == "file"
+            )
+
+        loose: List[Path] = []
+        for blob_path in self.objects_dir.glob("*/*"):
+            if blob_path.name in referenced:
+                loose.append(blob_path)
+            else:
+                blob_path.unlink()
+        for pack in sorted(self.packs_dir.glob("*.zip")):
+            with zipfile.ZipFile(pack) as archive:
+                members = archive.namelist()
+                live = [member for member in members if member in referenced]
+                if len(live) < len(members):
+                    # Repack only the live members; usually the pack just goes.
+                    self._write_pack(
+                        ((member, archive.read(member)) for member in live)
+                    )
+            if len(live) < len(members):
+                pack.unlink()
+        if len(loose) >= BACKUP_PACK_THRESHOLD:
+            self._write_pack(
+                (blob_path.name, blob_path.read_bytes()) for blob_path in loose
+            )
+            for blob_path in loose:
+                blob_path.unlink()
+        for directory in self.objects_dir.glob("*"):
+            try:
+                directory.rmdir()
+            except OSError:
+                pass
+        self._packed = None
+
+    def _write_pack(self, blobs: Iterable[Tuple[str, bytes]]) -> None:
+        self.packs_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.packs_dir / ("pack-%d.zip.tmp" % os.getpid())
+        written = 0
+        with zipfile.ZipFile(
+            tmp_path, "w", compression=zipfile.ZIP_DEFLATED
+        ) as archive:
+            for digest, content in blobs:
+                archive.writestr(digest, content)
+                written += 1
+        if not written:
+            tmp_path.unlink()
+            return
+        digest = hashlib.sha256(tmp_path.read_bytes()).hexdigest()
+        os.replace(tmp_path, self.packs_dir / ("pack-%s.zip" % digest[:16]))
+        logging.debug("Packed %d backup blobs", written)
+
+
+def recover_link_journal(use_symlink: bool, dry_run: bool) -> int:
+    """Finish the link operations an interrupted run left unfinished.
+
+    Backups the interrupted run took are recorded in its backup manifest,
+    begun but unfinished operations are planned and applied again, and all
+    operations it completed are added to the link manifest, so the run that
+    follows does not redo them. Returns the number of replayed operations.
+    """
+    records = LinkJournal.read(LINK_JOURNAL_PATH)
+    if not records:
+        return 0
+    header = records[0] if records[0].get("op") == "run" else {}
+    begun: Dict[str, dict] = {}
+    done: Set[str] = set()
+    backups_by_run: Dict[str, Dict[str, dict]] = {}
+    for record in records:
+        if record.get("op") == "begin":
+            begun[record["target"]] = record
+        elif record.get("op") == "done":
+            done.add(record["target"])
+        elif record.get("op") == "backup":
+            backups_by_run.setdefault(record["run"], {}).update(record["entries"])
+    unfinished = [record for target, record in begun.items() if target not in done]
+    if dry_run:
+        logging.info(
+            "Dry-run:: would recover %d unfinished link operations of interrupted run %s",
+            len(unfinished),
+            header.get("run"),
+        )
+        return 0
+
+    logging.warning(
+        "Recovering interrupted run %s: %d link operations done, %d unfinished",
+        header.get("run"),
+        len(done),
+        len(unfinished),
+    )
+    for run, entries in backups_by_run.items():
+        interrupted_backups = BackupStore(BACKUP_ROOT, run)
+        interrupted_backups.entries = entries
+        interrupted_backups.finish()
+
+    stats = StatCache()
+    backups = BackupStore(BACKUP_ROOT, BACKUP_RUN)
+    backed_up = {
+        str(HOME_DIR / relative)
+        for entries in backups_by_run.values()
+        for relative in entries
+    }
+    recovered = set(done)
+    for record in unfinished:
+        target, source = Path(record["target"]), Path(record["source"])
+        tmp_path = target.with_name(
+            ".%s.dotfiles-%d.tmp" % (target.name, header.get("pid", 0))
+        )
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        backup = (
+            record["action"] == LINK_ACTION_BACKUP and record["target"] not in backed_up
+        )
+        entry = plan_link_for_file(target, source, use_symlink, backup, False, stats)
+        try:
+            if entry.action != LINK_ACTION_KEEP:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                apply_planned_link(entry, use_symlink, False, stats, backups)
+        except OSError as exc:
+            logging.error("Failed to recover link '%s': %s", target, exc)
+            continue
+        recovered.add(record["target"])
+    backups.finish()
+
+    manifest = load_link_manifest(use_symlink)
+    links = manifest.get("links", {})
+    for target in recovered:
+        source = Path(begun[target]["source"])
+        links[target] = _manifest_entry(source, _source_fingerprint(source, stats))
+    # No commit: the next pass enumerates everything but trusts these entries.
+    write_link_manifest(links, use_symlink, manifest.get("dotfiles", []), None)
+    LINK_JOURNAL_PATH.unlink()
+    return len(unfinished)
+
+
 def setup_dotfile_links(
     use_symlink: bool = True,
     backup: bool = True,
     dry_run: bool = False,
     force: bool = False,
+    workers: int = LINK_WORKERS,
+    verify: bool = False,
+    use_git_index: bool = True,
+    backup_keep: int = BACKUP_KEEP_RUNS,
 ) -> None:
+    """Link all DOTFILES into HOME in two phases.
+
+    First every (target, source) pair is planned without touching the home
+    directory, then the plan is applied with a bounded thread pool.
 
+    Targets recorded in the link manifest whose source is unchanged are not
+    looked at again unless force or verify is set; entries that vanished from
+    the repository since the last run are pruned from HOME. In a git checkout
+    the changed entries come from a diff against the last installed commit.
+    """
     logging.debug("Setting up links for dotfiles in %s/", HOME_DIR)
-    links_created = {}
-    used_directory_symlink_fallback = False
 
-    if is_running_in_docker():
+    if get_host_facts().in_container:
         for ignored_path in PATHS_IGNORED_IN_DOCKER:
-            DOTFILES.remove(ignored_path)
-
-    for dotfile in DOTFILES:
+            DOTFILES.discard(ignored_path)
+    dotfiles = sorted(DOTFILES)
+    recover_link_journal(use_symlink, dry_run)
+    stats = StatCache()
+    journal = None if dry_run else LinkJournal(LINK_JOURNAL_PATH)
+    backups = BackupStore(BACKUP_ROOT, BACKUP_RUN, journal)
+
+    for dotfile in dotfiles:
         dotfile_path = get_dotfiles_path(dotfile)
-        target_path = get_home_path(dotfile)
         if dotfile_path.is_dir():
             # For directories in the repo, create links for individual files
             # inside the directory instead of linking the directory itself.
-            #
-            # If the home-side target is a directory-level symlink pointing
-            # into the repo (left over from an old install), remove it first
-            # so that per-file linking can take over cleanly.
-            if target_path.is_symlink() and target_path.is_dir():
-                target_resolved = target_path.resolve()
-                dotfile_resolved = dotfile_path.resolve()
-                if target_resolved == dotfile_resolved:
-                    msg = (
-                        "Removing stale directory symlink '%s' "
-                        "(pointed into repo; switching to per-file links)" % target_path
-                    )
-                    if dry_run:
-                        logging.debug(
-                            "Dry-run:: would remove stale directory symlink '%s' "
-                            "(pointed into repo; switching to per-file links)",
-                            target_path,
-                        )
-                    else:
-                        logging.info(msg)
-                        target_path.unlink()
+            _remove_stale_directory_symlink(
+                get_home_path(dotfile), dotfile_path, dry_run, stats
+            )
 
-            logging.debug(
-                "Creating links for files inside directory '%s'", dotfile_path
+    manifest = {} if force or verify else load_link_manifest(use_symlink)
+    recorded_links = manifest.get("links", {})
+    head_commit = git_head_commit() if use_git_index else None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        changed_paths = None
+        if (
+            head_commit
+            and manifest.get("commit")
+            and manifest.get("dotfiles") == dotfiles
+        ):
+            changed_paths = git_changed_files(manifest["commit"], dotfiles)
+
+        if changed_paths is not None:
+            logging.info(
+                "Git diff since last install (%s): %d changed paths",
+                manifest["commit"][:12],
+                len(changed_paths),
             )
-            try:
-                result = create_links_for_directory(
-                    dotfile_path, use_symlink, backup, dry_run, force
-                )
-                if result:
-                    links_created.update(result)
-            except Exception as exc:  # pragma: no cover - defensive logging
-                logging.error(
-                    "Failed to create links for directory '%s': %s",
-                    dotfile_path,
-                    exc,
+            link_pairs = [
+                (get_home_path(path), get_dotfiles_path(path))
+                for path in changed_paths
+                if stats.lstat(get_dotfiles_path(path)) is not None
+            ]
+            candidates = dict(recorded_links)
+            for path in changed_paths:
+                candidates.pop(str(get_home_path(path)), None)
+        else:
+            link_pairs = enumerate_dotfile_links(dotfiles, use_git_index, stats)
+            candidates = recorded_links
+
+        fingerprints = dict(
+            zip(
+                (str(target) for target, _ in link_pairs),
+                executor.map(
+                    lambda pair: _source_fingerprint(pair[1], stats), link_pairs
+                ),
+            )
+        )
+        unchanged = {}
+        changed_pairs = []
+        for target, source in link_pairs:
+            recorded = recorded_links.get(str(target))
+            if recorded == _manifest_entry(source, fingerprints[str(target)]):
+                unchanged[str(target)] = recorded
+            else:
+                changed_pairs.append((target, source))
+        if changed_paths is not None:
+            # Entries outside the diff are trusted as recorded.
+            unchanged.update(candidates)
+            removed = {
+                str(get_home_path(path)): recorded_links[str(get_home_path(path))]
+                for path in changed_paths
+                if str(get_home_path(path)) in recorded_links
+                and str(get_home_path(path)) not in fingerprints
+            }
+        else:
+            removed = {
+                target: entry
+                for target, entry in candidates.items()
+                if target not in fingerprints
+            }
+        if recorded_links:
+            logging.info(
+                "Link manifest: %d unchanged, %d added/modified, %d removed",
+                len(unchanged),
+                len(changed_pairs),
+                len(removed),
+            )
+
+        with timed("links: plan"):
+            plan = list(
+                executor.map(
+                    lambda pair: plan_link_for_file(
+                        pair[0], pair[1], use_symlink, backup, force, stats
+                    ),
+                    changed_pairs,
                 )
-            continue
+            )
+        with timed("links: apply"):
+            links_created = apply_link_plan(
+                plan, use_symlink, dry_run, executor, stats, backups, journal
+            )
+            prune_failed = prune_removed_links(removed, use_symlink, dry_run)
 
-        result = create_link_for_file(
-            target_path, dotfile_path, use_symlink, backup, dry_run, force
+    if not dry_run:
+        finish_backup_run(backups, backup_keep)
+        installed = dict(unchanged)
+        for entry in plan:
+            target = str(entry.target)
+            if entry.action == LINK_ACTION_KEEP or target in links_created:
+                installed[target] = _manifest_entry(entry.source, fingerprints[target])
+        # Only remember the commit when everything got linked and pruned;
+        # otherwise the next run must enumerate all entries again to retry
+        # the failures.
+        complete = len(installed) == len(unchanged) + len(plan) and not prune_failed
+        installed.update(prune_failed)
+        write_link_manifest(
+            installed, use_symlink, dotfiles, head_commit if complete else None
         )
-        if result:
-            links_created.update(result)
+        journal.close()
+
+    stats.log_calls("Link setup")
     mode_label = "sym" if use_symlink else "hard"
-    if used_directory_symlink_fallback:
-        mode_label = "hard (directory entries as sym)"
     logging.info(
         "Successfully set up %d %s-links for dotfiles in %s",
         len(links_created),
@@ -402,25 +1525,244 @@ def setup_dotfile_links(
     )
 
 
-def create_links_for_directory(
-    dotfile_dir: Path,
-    use_symlink: bool,
-    backup: bool,
-    dry_run: bool,
-    force: bool,
-) -> dict:
-    links_created = {}
-    repo_root = SCRIPT_DIR
+def finish_backup_run(backups: BackupStore, keep_runs: int) -> None:
+    """Record this run's backups; maintain the store when it changed."""
+    try:
+        legacy_runs = BACKUP_ROOT.is_dir() and any(
+            LEGACY_BACKUP_RUN_PATTERN.match(name) for name in os.listdir(BACKUP_ROOT)
+        )
+        if backups.finish() is None and not legacy_runs:
+            return
+        backups.import_legacy_runs()
+        backups.maintain(keep_runs)
+    except (OSError, ValueError, zipfile.BadZipFile) as exc:
+        logging.warning("Backup store maintenance in '%s' failed: %s", BACKUP_ROOT, exc)
 
-    # Resolve the dotfile_dir to its real path on disk. If the entry in the
-    # repo is itself a symlink (e.g. from a previous directory-level install
-    # that pointed ~/.config -> dotfiles/.config), resolve it so that we are
-    # always walking the canonical repo directory and never following the link
-    # out into the live home directory.
-    real_dotfile_dir = dotfile_dir.resolve()
-    if not str(real_dotfile_dir).startswith(str(repo_root.resolve())):
-        logging.error(
-            "Directory '%s' resolves to '%s' which is outside the repository "
+
+def enumerate_dotfile_links(
+    dotfiles: List[str],
+    use_git_index: bool = True,
+    stats: Union[StatCache, None] = None,
+) -> List[Tuple[Path, Path]]:
+    """Return (target, source) pairs for every file covered by dotfiles.
+
+    Prefers the tracked file list from the git index (one git call, no
+    untracked junk) and falls back to walking the checkout.
+    """
+    stats = stats if stats is not None else StatCache()
+    tracked = git_tracked_files(dotfiles) if use_git_index else None
+    if tracked is not None:
+        logging.debug("Using %d tracked files from the git index", len(tracked))
+        return [
+            (get_home_path(path), get_dotfiles_path(path))
+            for path in tracked
+            if stats.lstat(get_dotfiles_path(path)) is not None
+        ]
+
+    link_pairs: List[Tuple[Path, Path]] = []
+    for dotfile in dotfiles:
+        dotfile_path = get_dotfiles_path(dotfile)
+        if dotfile_path.is_dir():
+            logging.debug(
+                "Collecting links for files inside directory '%s'", dotfile_path
+            )
+            link_pairs.extend(collect_directory_links(dotfile_path, stats))
+        else:
+            link_pairs.append((get_home_path(dotfile), dotfile_path))
+    return link_pairs
+
+
+def _run_git(args: List[str]) -> Union[str, None]:
+    """Run git in the dotfiles checkout; None if SCRIPT_DIR is not one."""
+    if which("git") is None or not (SCRIPT_DIR / ".git").exists():
+        return None
+    result = run_command(
+        ["git", *args],
+        cwd=SCRIPT_DIR,
+    )
+    if result.returncode != 0:
+        logging.debug("'git %s' failed: %s", " ".join(args), result.stderr.strip())
+        return None
+    return result.stdout
+
+
+def git_head_commit() -> Union[str, None]:
+    output = _run_git(["rev-parse", "--verify", "-q", "HEAD"])
+    return output.strip() if output else None
+
+
+def git_tracked_files(dotfiles: List[str]) -> Union[List[str], None]:
+    output = _run_git(["ls-files", "-z", "--", *dotfiles])
+    if output is None:
+        return None
+    return [path for path in output.split("\0") if path]
+
+
+def git_changed_files(since_commit: str, dotfiles: List[str]) -> Union[List[str], None]:
+    """Return tracked paths that differ between since_commit and the worktree.
+
+    Comparing against the worktree (not only HEAD) also covers staged and
+    uncommitted changes to tracked files.
+    """
+    output = _run_git(
+        ["diff", "--name-only", "--no-renames", "-z", since_commit, "--", *dotfiles]
+    )
+    if output is None:
+        return None
+    return [path for path in output.split("\0") if path]
+
+
+def _source_fingerprint(source: Path, stats: StatCache) -> Tuple[int, int]:
+    stat_result = stats.stat(source)
+    if stat_result is None:
+        return (0, 0)
+    return (stat_result.st_ino, stat_result.st_mtime_ns)
+
+
+def _manifest_entry(source: Path, fingerprint: Tuple[int, int]) -> dict:
+    return {"source": str(source), "inode": fingerprint[0], "mtime": fingerprint[1]}
+
+
+def load_link_manifest(use_symlink: bool) -> dict:
+    """Return the manifest of the last run, or {} if it cannot be trusted."""
+    try:
+        with open(LINK_MANIFEST_PATH, encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        logging.debug("No link manifest at '%s'", LINK_MANIFEST_PATH)
+        return {}
+    except (OSError, ValueError) as exc:
+        logging.warning(
+            "Ignoring unreadable link manifest '%s': %s", LINK_MANIFEST_PATH, exc
+        )
+        return {}
+
+    if (
+        not isinstance(data, dict)
+        or data.get("version") != LINK_MANIFEST_VERSION
+        or data.get("home") != str(HOME_DIR)
+        or data.get("repo") != str(SCRIPT_DIR)
+        or data.get("use_symlink") != use_symlink
+    ):
+        logging.debug("Link manifest does not match this setup; ignoring it")
+        return {}
+    return data
+
+
+def write_link_manifest(
+    links: dict,
+    use_symlink: bool,
+    dotfiles: List[str],
+    commit: Union[str, None],
+) -> None:
+    data = {
+        "version": LINK_MANIFEST_VERSION,
+        "home": str(HOME_DIR),
+        "repo": str(SCRIPT_DIR),
+        "use_symlink": use_symlink,
+        "dotfiles": dotfiles,
+        "commit": commit,
+        "links": links,
+    }
+    try:
+        LINK_MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = LINK_MANIFEST_PATH.with_name(LINK_MANIFEST_PATH.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, LINK_MANIFEST_PATH)
+    except OSError as exc:
+        logging.warning(
+            "Failed to write link manifest '%s': %s", LINK_MANIFEST_PATH, exc
+        )
+        return
+    logging.debug("Recorded %d links in '%s'", len(links), LINK_MANIFEST_PATH)
+
+
+def prune_removed_links(removed: dict, use_symlink: bool, dry_run: bool) -> dict:
+    """Remove links whose source was deleted from the repository.
+
+    A target is only removed while it is still the link we created; anything
+    the user put there in the meantime is left alone. Returns the entries
+    that could not be removed, to be retried by the next run.
+    """
+    failed = {}
+    for target, entry in sorted(removed.items()):
+        target_path = Path(target)
+        try:
+            if use_symlink:
+                ours = target_path.is_symlink() and os.path.normpath(
+                    target_path.parent / os.readlink(target_path)
+                ) == os.path.normpath(entry["source"])
+            else:
+                ours = (
+                    not target_path.is_symlink()
+                    and target_path.stat().st_ino == entry["inode"]
+                )
+        except OSError:
+            ours = False
+        if not ours:
+            logging.debug("Not pruning '%s'; it is no longer our link", target_path)
+            continue
+        if dry_run:
+            logging.info(
+                "Dry-run:: would prune link '%s' (source removed)", target_path
+            )
+            continue
+        logging.info(
+            "Pruning link '%s' (source '%s' removed)", target_path, entry["source"]
+        )
+        try:
+            target_path.unlink()
+        except FileNotFoundError:
+            logging.debug("'%s' is already gone", target_path)
+        except OSError as exc:
+            logging.error("Failed to prune link '%s': %s", target_path, exc)
+            failed[target] = entry
+    return failed
+
+
+def _remove_stale_directory_symlink(
+    target_path: Path, dotfile_path: Path, dry_run: bool, stats: StatCache
+) -> None:
+    # If the home-side target is a directory-level symlink pointing into the
+    # repo (left over from an old install), remove it first so that per-file
+    # linking can take over cleanly.
+    if not stats.is_symlink(target_path):
+        return
+    if stats.realpath(target_path) != stats.realpath(dotfile_path):
+        return
+    if dry_run:
+        logging.debug(
+            "Dry-run:: would remove stale directory symlink '%s' "
+            "(pointed into repo; switching to per-file links)",
+            target_path,
+        )
+        return
+    logging.info(
+        "Removing stale directory symlink '%s' "
+        "(pointed into repo; switching to per-file links)",
+        target_path,
+    )
+    target_path.unlink()
+    stats.invalidate(target_path)
+
+
+def collect_directory_links(
+    dotfile_dir: Path, stats: Union[StatCache, None] = None
+) -> List[Tuple[Path, Path]]:
+    """Return (target, source) pairs for every file below a repo directory."""
+    stats = stats if stats is not None else StatCache()
+    repo_root = stats.realpath(SCRIPT_DIR)
+
+    # Resolve the dotfile_dir to its real path on disk. If the entry in the
+    # repo is itself a symlink (e.g. from a previous directory-level install
+    # that pointed ~/.config -> dotfiles/.config), resolve it so that we are
+    # always walking the canonical repo directory and never following the link
+    # out into the live home directory.
+    real_dotfile_dir = stats.realpath(dotfile_dir)
+    if not real_dotfile_dir.startswith(repo_root):
+        logging.error(
+            "Directory '%s' resolves to '%s' which is outside the repository "
             "root '%s'. The repo must not contain symlinks pointing outside "
             "itself. Remove the offending symlink and re-run.",
             dotfile_dir,
@@ -429,52 +1771,38 @@ def create_links_for_directory(
         )
         sys.exit(1)
 
-    # followlinks=False so we never accidentally walk into symlinked subtrees
-    # inside the repo directory.
-    for root, _, files in os.walk(real_dotfile_dir, followlinks=False):
-        logging.debug("Setting up link for files in folder '%s'", root)
-        for name in files:
-            # Compute path relative to repository root so get_dotfiles_path
-            # and get_home_path produce the correct targets.
-            root_path = Path(root)
-            try:
-                rel = root_path.relative_to(repo_root.resolve())
-            except ValueError:
-                logging.warning(
-                    "Cannot compute relative path for '%s'; skipping.", root_path
-                )
-                continue
-            relative_path = rel / name
-
-            dotfile_path = get_dotfiles_path(relative_path)
-            target_path = get_home_path(relative_path)
-            logging.debug(
-                "Setting up link for file in folder: Target '%s' -> Dotfile '%s'",
-                target_path,
-                dotfile_path,
-            )
-            result = create_link_for_file(
-                target_path, dotfile_path, use_symlink, backup, dry_run, force
-            )
-            if result:
-                links_created.update(result)
-    return links_created
+    # Relative paths are computed on strings against the resolved repository
+    # root, so get_dotfiles_path and get_home_path produce the correct targets.
+    link_pairs: List[Tuple[Path, Path]] = []
+    prefix_length = len(repo_root.rstrip(os.sep) + os.sep)
+    for path in stats.scan_files(real_dotfile_dir):
+        relative_path = path[prefix_length:]
+        link_pairs.append(
+            (get_home_path(relative_path), get_dotfiles_path(relative_path))
+        )
+    return link_pairs
 
 
 def _existing_link_correct(
-    target_path: Path, dotfile_path: Path, use_symlink: bool
+    target_path: Path, dotfile_path: Path, use_symlink: bool, stats: StatCache
 ) -> bool:
     if use_symlink:
-        if target_path.is_symlink() and target_path.resolve() == dotfile_path.resolve():
+        if stats.is_symlink(target_path) and stats.realpath(
+            target_path
+        ) == stats.realpath(dotfile_path):
             logging.debug(
                 "'%s' is already a symlink to '%s'", target_path, dotfile_path
             )
             return True
     else:
+        target_stat = stats.lstat(target_path)
+        source_stat = stats.stat(dotfile_path)
         if (
-            target_path.is_file()
-            and not target_path.is_symlink()
-            and target_path.samefile(dotfile_path)
+            target_stat is not None
+            and source_stat is not None
+            and stat.S_ISREG(target_stat.st_mode)
+            and (target_stat.st_dev, target_stat.st_ino)
+            == (source_stat.st_dev, source_stat.st_ino)
         ):
             logging.debug(
                 "'%s' is already a hard link to '%s'", target_path, dotfile_path
@@ -483,140 +1811,310 @@ def _existing_link_correct(
     return False
 
 
-def create_link_for_file(
+def plan_link_for_file(
     target_path: Path,
     dotfile_path: Path,
     use_symlink: bool,
     backup: bool,
-    dry_run: bool,
     force: bool,
+    stats: Union[StatCache, None] = None,
+) -> PlannedLink:
+    """Decide what needs to happen for a single target without changing it."""
+    stats = stats if stats is not None else StatCache()
+    # HOME_DIR and SCRIPT_DIR are absolute, so are all paths derived from them.
+    target_abs_path = target_path.absolute()
+    if dotfile_path.absolute() == target_abs_path:
+        logging.error(
+            "Dotfile path and target path are the same: '%s'. "
+            "This should never happen — check your DOTFILES entries and "
+            "that the repo is not checked out inside HOME in a conflicting way.",
+            dotfile_path,
+        )
+        sys.exit(1)
+
+    target_stat = stats.lstat(target_abs_path)
+    if target_stat is None:
+        logging.debug("Link '%s' does not exist yet", target_abs_path)
+        return PlannedLink(target_abs_path, dotfile_path, LINK_ACTION_CREATE)
+    is_symlink = stat.S_ISLNK(target_stat.st_mode)
+
+    if stats.realpath(dotfile_path) == stats.realpath(target_abs_path):
+        # The target already resolves to the exact same file as the
+        # dotfile (e.g. because a parent directory is a symlink pointing
+        # into the repo). Nothing to do and nothing to back up.
+        logging.debug(
+            "Dotfile and target resolve to the same file; skipping: '%s'",
+            dotfile_path,
+        )
+        return PlannedLink(target_abs_path, dotfile_path, LINK_ACTION_KEEP)
+
+    if not force and _existing_link_correct(
+        target_abs_path, dotfile_path, use_symlink, stats
+    ):
+        return PlannedLink(target_abs_path, dotfile_path, LINK_ACTION_KEEP)
+    # Symlinks are NOT backed up — they were created by a previous dotfiles run.
+    if backup and not is_symlink:
+        return PlannedLink(target_abs_path, dotfile_path, LINK_ACTION_BACKUP)
+    return PlannedLink(target_abs_path, dotfile_path, LINK_ACTION_REPLACE)
+
+
+def apply_link_plan(
+    plan: List[PlannedLink],
+    use_symlink: bool,
+    dry_run: bool,
+    executor: ThreadPoolExecutor,
+    stats: Union[StatCache, None] = None,
+    backups: Union[BackupStore, None] = None,
+    journal: Union[LinkJournal, None] = None,
 ) -> dict:
+    """Apply a link plan concurrently and return {target: source} of new links."""
+    stats = stats if stats is not None else StatCache()
+    backups = backups if backups is not None else BackupStore(BACKUP_ROOT, BACKUP_RUN)
+    pending = [entry for entry in plan if entry.action != LINK_ACTION_KEEP]
+    for entry in plan:
+        if entry.action == LINK_ACTION_KEEP:
+            logging.info("Correct link already exists: '%s'", entry.target)
+
     if not dry_run:
-        if dotfile_path.absolute() == target_path.absolute():
-            logging.error(
-                "Dotfile path and target path are the same: '%s'. "
-                "This should never happen — check your DOTFILES entries and "
-                "that the repo is not checked out inside HOME in a conflicting way.",
-                dotfile_path,
-            )
-            sys.exit(1)
-        if dotfile_path.resolve() == target_path.resolve():
-            # The target already resolves to the exact same file as the
-            # dotfile (e.g. because a parent directory is a symlink pointing
-            # into the repo). Nothing to do and nothing to back up.
-            logging.debug(
-                "Dotfile and target resolve to the same file; skipping: '%s'",
-                dotfile_path,
+        # mkdir(parents=True, exist_ok=True) is safe to run concurrently;
+        # dedupe first so shared parents are only created once.
+        parents = sorted(
+            parent
+            for parent in {entry.target.parent for entry in pending}
+            if not _is_dir_stat(stats.lstat(parent))
+        )
+        stats.count("mkdir", len(parents))
+        list(
+            executor.map(
+                lambda parent: parent.mkdir(parents=True, exist_ok=True), parents
             )
-            return {}
+        )
 
-    target_abs_path = target_path.absolute()
-    if target_abs_path.exists() or target_abs_path.is_symlink():
-        # STEP 1: Backup regular files/dirs (not symlinks) to BACKUP_DIR before linking.
-        # Symlinks are NOT backed up — they were created by a previous dotfiles run.
-        # Guard: skip if backup_path already exists.
-        if backup and target_abs_path.exists() and not target_abs_path.is_symlink():
-            try:
-                rel_path = target_abs_path.relative_to(HOME_DIR)
-            except ValueError:
-                logging.warning(
-                    "Cannot backup '%s' — outside HOME directory",
-                    target_abs_path,
-                )
-            else:
-                backup_path = BACKUP_DIR / rel_path
-                if backup_path.exists():
-                    logging.debug(
-                        "Backup already exists at '%s', skipping inline backup of '%s'",
-                        backup_path,
-                        target_abs_path,
-                    )
-                else:
-                    if dry_run:
-                        logging.info(
-                            "Dry-run:: would back up file '%s' to '%s'",
-                            target_abs_path,
-                            backup_path,
-                        )
-                    else:
-                        backup_path.parent.mkdir(parents=True, exist_ok=True)
-                        logging.info(
-                            "Backing up file '%s' to '%s'",
-                            target_abs_path,
-                            backup_path,
-                        )
-                        shutil.move(str(target_abs_path), str(backup_path))
-                        # After move, target no longer exists, fall through to link creation
+    links_created = {}
+    futures = {
+        executor.submit(
+            _apply_journaled, entry, use_symlink, dry_run, stats, backups, journal
+        ): entry
+        for entry in pending
+    }
+    for future in as_completed(futures):
+        entry = futures[future]
+        try:
+            future.result()
+        except Exception as exc:  # pragma: no cover - defensive logging
+            logging.error("Failed to create link '%s': %s", entry.target, exc)
+            continue
+        links_created[str(entry.target)] = str(entry.source)
+    return links_created
 
-        # STEP 2: If force=True, remove whatever remains (symlinks, broken links) to force recreation.
-        if force and (target_abs_path.exists() or target_abs_path.is_symlink()):
-            if target_abs_path.is_dir() and not target_abs_path.is_symlink():
-                message = "Force removing directory '%s'" % target_abs_path
-            else:
-                message = "Force removing link '%s'" % target_abs_path
-            if dry_run:
-                logging.debug("Dry-run:: " + message)
-            else:
-                logging.debug(message)
-                if target_abs_path.is_dir() and not target_abs_path.is_symlink():
-                    shutil.rmtree(target_abs_path)
-                else:
-                    os.remove(target_abs_path)
-
-        # STEP 3: If not force, check if we can skip or need to fix an incorrect link.
-        elif not force:
-            if _existing_link_correct(target_path, dotfile_path, use_symlink):
-                logging.info("Correct link already exists: '%s'", target_abs_path)
-                return None
 
-            # Incorrect target (wrong symlink or leftover regular file): remove it.
-            if target_abs_path.exists() or target_abs_path.is_symlink():
-                if target_abs_path.is_dir() and not target_abs_path.is_symlink():
-                    message = "Removing incorrect directory '%s'" % target_abs_path
-                else:
-                    message = "Removing incorrect link '%s'" % target_abs_path
-                if dry_run:
-                    logging.debug("Dry-run:: " + message)
-                else:
-                    logging.debug(message)
-                    if target_abs_path.is_dir() and not target_abs_path.is_symlink():
-                        shutil.rmtree(target_abs_path)
-                    else:
-                        os.remove(target_abs_path)
+def restore_backup(run: str, dry_run: bool = False) -> int:
+    """Rebuild the files of a backup run in HOME; run may be 'latest'."""
+    store = BackupStore(BACKUP_ROOT)
+    runs = store.runs()
+    if run == "latest" and runs:
+        run = runs[-1]
+    if run not in runs:
+        logging.error(
+            "Unknown backup run '%s'. Available runs: %s",
+            run,
+            ", ".join(runs) or "none",
+        )
+        sys.exit(1)
 
-        # Verify target was removed successfully (unless dry_run)
-        if not dry_run and (target_abs_path.exists() or target_abs_path.is_symlink()):
-            raise FileExistsError(
-                f"Failed to remove target '{target_abs_path}' before creating link"
+    entries = store.load_run(run)["entries"]
+    # Parents first, so directories exist before the files inside them.
+    ordered = sorted(entries.items(), key=lambda item: item[0].count("/"))
+    if dry_run:
+        for relative, entry in ordered:
+            logging.info(
+                "Dry-run:: would restore %s '%s' from run %s",
+                entry["type"],
+                HOME_DIR / relative,
+                run,
             )
+        return len(ordered)
+
+    def replace(target: Path, create: Callable[[Path], None]) -> None:
+        # Like link replacement: build next to the target, then rename over it.
+        if target.is_dir() and not target.is_symlink():
+            shutil.rmtree(target)
+        tmp_path = target.with_name(".%s.dotfiles-%d.tmp" % (target.name, os.getpid()))
+        create(tmp_path)
+        os.replace(tmp_path, target)
+
+    digests = [entry["blob"] for entry in entries.values() if entry["type"] == "file"]
+    contents = dict(store.read_blobs(digests))
+    for relative, entry in ordered:
+        target = HOME_DIR / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if entry["type"] == "dir":
+            if target.is_symlink() or not target.is_dir():
+                # rename() cannot put a directory over a link or file
+                if os.path.lexists(target):
+                    target.unlink()
+                target.mkdir(mode=entry["mode"])
+        elif entry["type"] == "symlink":
+            replace(target, lambda tmp: tmp.symlink_to(entry["target"]))
+        else:
+
+            def write_file(tmp: Path) -> None:
+                tmp.write_bytes(contents[entry["blob"]])
+                tmp.chmod(entry["mode"])
+
+            replace(target, write_file)
+        logging.info("Restored '%s'", target)
+
+    # The restored files are not our links anymore; verify everything next run.
+    try:
+        LINK_MANIFEST_PATH.unlink()
+    except FileNotFoundError:
+        pass
+    logging.info("Restored %d entries from backup run %s", len(ordered), run)
+    return len(ordered)
+
+
+def _apply_journaled(
+    entry: PlannedLink,
+    use_symlink: bool,
+    dry_run: bool,
+    stats: StatCache,
+    backups: BackupStore,
+    journal: Union[LinkJournal, None],
+) -> None:
+    if journal is None:
+        apply_planned_link(entry, use_symlink, dry_run, stats, backups)
+        return
+    journal.record(
+        "begin", target=str(entry.target), source=str(entry.source), action=entry.action
+    )
+    apply_planned_link(entry, use_symlink, dry_run, stats, backups)
+    journal.record("done", target=str(entry.target))
+
+
+def _is_dir_stat(stat_result: Union[os.stat_result, None]) -> bool:
+    return stat_result is not None and stat.S_ISDIR(stat_result.st_mode)
+
+
+def _remove_target(
+    target_abs_path: Path, reason: str, dry_run: bool, stats: StatCache
+) -> None:
+    # lstat: a symlink to a directory is removed as a link, never recursed into
+    is_dir = _is_dir_stat(stats.lstat(target_abs_path))
+    if is_dir:
+        message = "%s directory '%s'" % (reason, target_abs_path)
     else:
-        logging.debug("Link '%s' does not exist yet", target_abs_path)
+        message = "%s link '%s'" % (reason, target_abs_path)
+    if dry_run:
+        logging.debug("Dry-run:: " + message)
+        return
+    logging.debug(message)
+    if is_dir:
+        shutil.rmtree(target_abs_path)
+    else:
+        os.remove(target_abs_path)
+    stats.invalidate(target_abs_path)
+
+
+def _backup_target(target_abs_path: Path, dry_run: bool, backups: BackupStore) -> None:
+    """Save a real file/dir into the backup store before it gets replaced.
+
+    The target stays in place until the link is renamed over it; directories
+    are removed by the caller afterwards.
+    """
+    try:
+        rel_path = target_abs_path.relative_to(HOME_DIR).as_posix()
+    except ValueError:
+        logging.warning("Cannot backup '%s' — outside HOME directory", target_abs_path)
+        return
+
+    if backups.contains(rel_path):
+        logging.debug("'%s' is already backed up in this run", target_abs_path)
+        return
+    if dry_run:
+        logging.info(
+            "Dry-run:: would back up '%s' (backup run %s)", target_abs_path, backups.run
+        )
+        return
+    logging.info("Backing up '%s' (backup run %s)", target_abs_path, backups.run)
+    backups.add(target_abs_path, rel_path)
 
-    if not dry_run:
-        target_path.parent.mkdir(parents=True, exist_ok=True)
+
+def _replace_with_link(target_abs_path: Path, link_to: Path, use_symlink: bool) -> None:
+    """Create the link under a temporary name and rename it over the target.
+
+    rename() swaps the directory entry atomically, so running shells never
+    see the target missing in between.
+    """
+    tmp_path = target_abs_path.with_name(
+        ".%s.dotfiles-%d.tmp" % (target_abs_path.name, os.getpid())
+    )
+    create_link = os.symlink if use_symlink else os.link
+    try:
+        create_link(link_to, tmp_path)
+    except FileExistsError:
+        # left over from an interrupted run
+        os.remove(tmp_path)
+        create_link(link_to, tmp_path)
+    try:
+        os.replace(tmp_path, target_abs_path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+    if not use_symlink and os.path.lexists(tmp_path):
+        # rename() is a no-op when both names are already the same inode
+        os.remove(tmp_path)
+
+
+def apply_planned_link(
+    entry: PlannedLink,
+    use_symlink: bool,
+    dry_run: bool,
+    stats: Union[StatCache, None] = None,
+    backups: Union[BackupStore, None] = None,
+) -> None:
+    target_abs_path, dotfile_path = entry.target, entry.source
+    stats = stats if stats is not None else StatCache()
+
+    if entry.action == LINK_ACTION_BACKUP:
+        backups = (
+            backups if backups is not None else BackupStore(BACKUP_ROOT, BACKUP_RUN)
+        )
+        _backup_target(target_abs_path, dry_run, backups)
+    replace = entry.action in (LINK_ACTION_BACKUP, LINK_ACTION_REPLACE)
+    if replace and _is_dir_stat(stats.lstat(target_abs_path)):
+        # A link cannot be renamed over a real directory; it has to go first.
+        _remove_target(target_abs_path, "Removing incorrect", dry_run, stats)
 
     if use_symlink:
         # Note: failed trying to get relative path using pathlib
-        relative_link = Path(os.path.relpath(dotfile_path, target_abs_path.parent))
-        message = f"Creating symlink: Target '{target_path}' -> Link '{relative_link}'"
-        if dry_run:
-            logging.debug("Dry-run:: " + message)
-        else:
-            logging.debug(message)
-            target_path.absolute().symlink_to(relative_link)
+        link_to = Path(os.path.relpath(dotfile_path, target_abs_path.parent))
+        message = f"Creating symlink: Target '{target_abs_path}' -> Link '{link_to}'"
     else:
-        message = f"Creating hard link: Target '{target_path}' -> Link '{dotfile_path}'"
-        if dry_run:
-            logging.debug("Dry-run:: " + message)
-        else:
-            logging.debug(message)
-            target_path.absolute().hardlink_to(dotfile_path)
-
-    return {str(target_path): str(dotfile_path)}
+        link_to = dotfile_path
+        message = (
+            f"Creating hard link: Target '{target_abs_path}' -> Link '{dotfile_path}'"
+        )
+    if dry_run:
+        logging.debug("Dry-run:: " + message)
+        return
+    logging.debug(message)
+    if replace and stats.lstat(target_abs_path) is not None:
+        _replace_with_link(target_abs_path, link_to, use_symlink)
+    elif use_symlink:
+        # apply_link_plan created the parent directories up front
+        target_abs_path.symlink_to(link_to)
+    else:
+        target_abs_path.hardlink_to(link_to)
+    stats.invalidate(target_abs_path)
 
 
-def install_apt_packages(dry_run: bool = False, ui: bool = False) -> None:
-    if shutil.which("apt-get") is None:
+def install_apt_packages(
+    dry_run: bool = False,
+    ui: bool = False,
+    max_age_hours: float = APT_LISTS_MAX_AGE_HOURS,
+) -> None:
+    if not get_host_facts().has_apt:
         logging.info("apt-get not found. Skipping apt package installation.")
         return
 
@@ -624,68 +2122,88 @@ def install_apt_packages(dry_run: bool = False, ui: bool = False) -> None:
 
     # Add UI packages if not headless mode
     if ui:
-        packages.extend(UI_PACKAGES)
+        packages |= UI_PACKAGES
     else:
         logging.info("Not installing UI packages.")
 
-    logging.info("Installing apt packages: %s", ", ".join(packages))
-    update_command = ["sudo", "apt-get", "update"]
-
+    logging.info("Checking apt packages: %s", ", ".join(sorted(packages)))
     try:
-        if not dry_run:
-            subprocess.run(
-                update_command,
-                check=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                encoding="utf-8",
-            )
+        plan = run_apt_transaction(sorted(packages), dry_run, max_age_hours)
+    except subprocess.CalledProcessError as cpe:
+        logging.error("Failed to install apt packages: %s", cpe.stderr)
+        sys.exit(1)
+    if plan.install:
+        logging.info("Successfully installed apt packages")
 
-        (
-            available_packages,
-            unavailable_packages,
-            already_installed_packages,
-        ) = classify_apt_packages(packages)
 
-        if not available_packages and not unavailable_packages:
-            logging.info("All packages are already installed")
-            return
-        if unavailable_packages:
-            logging.warning(
-                "Packages not found in apt repositories (skipped): %s",
-                ", ".join(unavailable_packages),
-            )
+# Package state is looked up once per run (one dpkg-query and one apt-cache
+# call) and shared by the host and container install paths.
+_apt_state_lock = threading.Lock()
+_installed_apt_packages: Union[Set[str], None] = None
+_apt_candidates: Dict[str, Union[str, None]] = {}
 
-        if available_packages:
-            logging.info(
-                "The following packages will be installed: %s",
-                ", ".join(available_packages),
-            )
+
+def installed_apt_packages() -> Set[str]:
+    """Return the names of all installed packages (memoized)."""
+    global _installed_apt_packages
+    with _apt_state_lock:
+        if _installed_apt_packages is not None:
+            return _installed_apt_packages
+
+        installed: Set[str] = set()
+        if which("dpkg-query") is None:
+            logging.debug("dpkg-query not found; treating all packages as missing")
         else:
-            if already_installed_packages:
-                logging.info(
-                    "All available packages are already installed. Nothing to do."
-                )
-            else:
-                logging.warning(
-                    "No installable apt packages left after availability check."
-                )
-            return
+            result = run_command(
+                ["dpkg-query", "-W", "-f", "${Package}\t${db:Status-Abbrev}\n"],
+            )
+            for line in result.stdout.splitlines():
+                name, _, status = line.partition("\t")
+                # The second letter is the current state: "ii " installed,
+                # "hi " installed and held, "rc " only config files left.
+                if status[1:2] == "i":
+                    installed.add(name)
+        _installed_apt_packages = installed
+        return installed
 
-        install_command = ["sudo", "apt-get", "install", "-y"] + available_packages
-        if not dry_run:
-            result = subprocess.run(
-                install_command,
-                check=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                encoding="utf-8",
+
+def apt_candidate_versions(packages: List[str]) -> Dict[str, Union[str, None]]:
+    """Return {package: candidate version or None} with one apt-cache call.
+
+    Results are memoized; only packages not looked up before are queried.
+    """
+    with _apt_state_lock:
+        unknown = [pkg for pkg in packages if pkg not in _apt_candidates]
+        if unknown and which("apt-cache") is not None:
+            result = run_command(
+                ["apt-cache", "policy", *unknown],
             )
-            logging.debug(result.stdout)
-    except subprocess.CalledProcessError as cpe:
-        logging.error("Failed to install apt packages: %s", cpe.stderr)
-        sys.exit(1)
-    logging.info("Successfully installed apt packages")
+            _apt_candidates.update(_parse_apt_policy(result.stdout))
+        for pkg in unknown:
+            # apt-cache prints nothing for packages it does not know at all
+            _apt_candidates.setdefault(pkg, None)
+        return {pkg: _apt_candidates[pkg] for pkg in packages}
+
+
+def _parse_apt_policy(output: str) -> Dict[str, Union[str, None]]:
+    candidates: Dict[str, Union[str, None]] = {}
+    package = None
+    for line in output.splitlines():
+        if line and not line[0].isspace() and line.endswith(":"):
+            package = line[:-1]
+            candidates[package] = None
+        elif package and line.strip().startswith("Candidate:"):
+            version = line.split(":", 1)[1].strip()
+            candidates[package] = None if version == "(none)" else version
+    return candidates
+
+
+def invalidate_apt_package_state() -> None:
+    """Forget memoized package state after installing or refreshing indexes."""
+    global _installed_apt_packages
+    with _apt_state_lock:
+        _installed_apt_packages = None
+        _apt_candidates.clear()
 
 
 def classify_apt_packages(
@@ -694,65 +2212,181 @@ def classify_apt_packages(
     """
     Return (available_and_missing, unavailable, already_installed).
     """
-    if shutil.which("apt-cache") is None:
+    with timed("apt: classify packages"):
+        return _classify_apt_packages(packages)
+
+
+def _classify_apt_packages(
+    packages: List[str],
+) -> Tuple[List[str], List[str], List[str]]:
+    installed = installed_apt_packages()
+    already_installed = [pkg for pkg in packages if pkg in installed]
+    missing = [pkg for pkg in packages if pkg not in installed]
+
+    if which("apt-cache") is None:
         logging.info(
             "apt-cache not found. Missing packages cannot be verified and will be skipped."
         )
-        available = []
-        unavailable = []
-        already_installed = []
-        for package in packages:
-            if (
-                subprocess.run(
-                    ["dpkg", "-s", package],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                ).returncode
-                == 0
-            ):
-                already_installed.append(package)
-            else:
-                # Availability cannot be verified without apt-cache.
-                # Keep behavior conservative and skip unverified packages.
-                unavailable.append(package)
-        return available, unavailable, already_installed
-
-    available = []
-    unavailable = []
-    already_installed = []
-    for package in packages:
-        if (
-            subprocess.run(
-                ["dpkg", "-s", package], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            ).returncode
-            == 0
-        ):
-            already_installed.append(package)
+        # Availability cannot be verified without apt-cache.
+        # Keep behavior conservative and skip unverified packages.
+        return [], missing, already_installed
+
+    candidates = apt_candidate_versions(missing)
+    available = [pkg for pkg in missing if candidates[pkg]]
+    unavailable = [pkg for pkg in missing if not candidates[pkg]]
+    return available, unavailable, already_installed
+
+
+class AptPlan(NamedTuple):
+    install: List[str]
+    unavailable: List[str]
+    already_installed: List[str]
+    refresh: bool
+    reason: str
+
+
+def apt_lists_age_hours() -> float:
+    """Return hours since the package lists were last refreshed; inf if there are none.
+
+    apt dates list files by the repository's Release time and leaves them
+    alone when the server answers "not modified", so the stamps touched after
+    a successful 'apt-get update' count as well. Directory mtimes do not: a
+    failed update or 'rm -rf /var/lib/apt/lists/*' changes them too.
+    """
+    try:
+        with os.scandir(APT_LISTS_DIR) as entries:
+            lists = [entry.path for entry in entries if "_Packages" in entry.name]
+    except OSError:
+        lists = []
+    if not lists:
+        return float("inf")
+    stamps = [
+        *lists,
+        "/var/lib/apt/periodic/update-success-stamp",
+        str(APT_UPDATE_STAMP_PATH),
+    ]
+    newest = 0.0
+    for stamp in stamps:
+        try:
+            newest = max(newest, os.stat(stamp).st_mtime)
+        except OSError:
             continue
+    if not newest:
+        return float("inf")
+    return max(0.0, (datetime.now().timestamp() - newest) / 3600)
+
+
+def plan_apt_transaction(packages: List[str], max_age_hours: float) -> AptPlan:
+    """Decide what to install, and whether indexes need a refresh first.
+
+    Only local state is consulted (dpkg database and cached lists), so a run
+    where everything is installed never touches the network or the apt lock.
+    """
+    available, unavailable, already_installed = classify_apt_packages(packages)
+    if not available and not unavailable:
+        return AptPlan([], [], already_installed, False, "all packages installed")
 
-        result = subprocess.run(
-            ["apt-cache", "show", package],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding="utf-8",
+    age = apt_lists_age_hours()
+    if unavailable and age > min(APT_LISTS_MIN_REFRESH_HOURS, max_age_hours):
+        reason = "no install candidate for %s" % ", ".join(unavailable)
+        return AptPlan(available, unavailable, already_installed, True, reason)
+
+    if age > max_age_hours:
+        reason = "package lists are %.1fh old (max %.1fh)" % (age, max_age_hours)
+        return AptPlan(available, unavailable, already_installed, True, reason)
+
+    reason = "package lists are %.1fh old; using them as is" % age
+    return AptPlan(available, unavailable, already_installed, False, reason)
+
+
+def _touch_apt_update_stamp() -> None:
+    try:
+        APT_UPDATE_STAMP_PATH.parent.mkdir(parents=True, exist_ok=True)
+        APT_UPDATE_STAMP_PATH.touch()
+    except OSError as exc:
+        logging.debug("Failed to touch '%s': %s", APT_UPDATE_STAMP_PATH, exc)
+
+
+def _apt_get_command(*args: str) -> List[str]:
+    command = ["apt-get", *args]
+    return command if os.geteuid() == 0 else ["sudo", *command]
+
+
+def run_apt_transaction(
+    packages: List[str],
+    dry_run: bool,
+    max_age_hours: float,
+    install_args: Tuple[str, ...] = (),
+) -> AptPlan:
+    """Install missing packages with at most one update and one install call.
+
+    Raises subprocess.CalledProcessError if apt-get fails.
+    """
+    plan = plan_apt_transaction(packages, max_age_hours)
+    if not plan.install and not plan.unavailable:
+        logging.info("All packages are already installed")
+        return plan
+
+    logging.info(
+        "apt plan: %d missing, %s (%s)",
+        len(plan.install) + len(plan.unavailable),
+        "refreshing package lists" if plan.refresh else "skipping apt-get update",
+        plan.reason,
+    )
+    if plan.refresh:
+        if dry_run:
+            logging.info(
+                "Dry-run:: would run '%s'", " ".join(_apt_get_command("update"))
+            )
+        else:
+            with timed("apt: update"):
+                run_command(
+                    _apt_get_command("update", "-qq"),
+                    check=True,
+                )
+            _touch_apt_update_stamp()
+            invalidate_apt_package_state()
+            # Lists are fresh now; re-plan without allowing another refresh.
+            plan = plan_apt_transaction(packages, float("inf"))
+
+    if plan.unavailable:
+        logging.warning(
+            "Packages not found in apt repositories (skipped): %s",
+            ", ".join(plan.unavailable),
         )
-        if result.returncode == 0 and result.stdout.strip():
-            available.append(package)
+    if not plan.install:
+        if plan.already_installed:
+            logging.info("All available packages are already installed. Nothing to do.")
         else:
-            unavailable.append(package)
-    return available, unavailable, already_installed
+            logging.warning(
+                "No installable apt packages left after availability check."
+            )
+        return plan
+
+    logging.info(
+        "The following packages will be installed: %s", ", ".join(plan.install)
+    )
+    install_command = _apt_get_command("install", "-y", *install_args, *plan.install)
+    if dry_run:
+        logging.info("Dry-run:: would run '%s'", " ".join(install_command))
+        return plan
+    with timed("apt: install"):
+        result = run_command(
+            install_command,
+            check=True,
+        )
+    logging.debug(result.stdout)
+    invalidate_apt_package_state()
+    return plan
 
 
 def get_installed_font_families() -> Set[str]:
-    if shutil.which("fc-list") is None:
+    if which("fc-list") is None:
         logging.debug("fc-list not found; font presence checks are disabled.")
         return set()
 
-    result = subprocess.run(
+    result = run_command(
         ["fc-list", ":", "family"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        encoding="utf-8",
     )
     if result.returncode != 0:
         logging.debug("fc-list failed: %s", result.stderr.strip())
@@ -771,227 +2405,975 @@ def _normalize_font_token(value: str) -> str:
     return "".join(ch for ch in value.lower() if ch.isalnum())
 
 
-def _has_font_family(
-    installed_families: Set[str], family_hints: Union[str, List[str]]
-) -> bool:
-    hints = [family_hints] if isinstance(family_hints, str) else family_hints
-    normalized_hints = {
-        _normalize_font_token(hint) for hint in hints if _normalize_font_token(hint)
-    }
-    normalized_families = {
-        _normalize_font_token(family)
-        for family in installed_families
-        if _normalize_font_token(family)
-    }
-    # fc-list often reports extended family names like "robotomono nerd font";
-    # treat a family as present when any normalized hint is contained in it.
-    for hint in normalized_hints:
-        for family in normalized_families:
-            if hint == family or hint in family:
-                return True
-    return False
+class FontIndex:
+    """Normalized names of installed font families, built once per run.
+
+    fc-list often reports extended family names like "robotomono nerd font",
+    so a family counts as present when a normalized hint is contained in any
+    indexed name. All names are joined into one NUL-separated string so that
+    check is a single substring search instead of a hint x family loop.
+    """
+
+    def __init__(self, families: Iterable[str] = ()) -> None:
+        self._tokens: Set[str] = set()
+        self._haystack = ""
+        self.add(families)
+
+    def add(self, families: Iterable[str]) -> None:
+        tokens = {_normalize_font_token(family) for family in families}
+        tokens.discard("")
+        if not tokens <= self._tokens:
+            self._tokens |= tokens
+            self._haystack = "\0".join(sorted(self._tokens))
+
+    def add_font_files(self, font_dir: Path) -> None:
+        """Index the file names in font_dir (e.g. 'FiraCodeNerdFont-Regular.ttf')."""
+        try:
+            with os.scandir(font_dir) as entries:
+                self.add(
+                    os.path.splitext(entry.name)[0]
+                    for entry in entries
+                    if os.path.splitext(entry.name)[1].lower() in FONT_SUFFIXES
+                )
+        except OSError:
+            return
+
+    def contains(self, family_hints: Union[str, List[str]]) -> bool:
+        hints = [family_hints] if isinstance(family_hints, str) else family_hints
+        return any(
+            token and token in self._haystack
+            for token in map(_normalize_font_token, hints)
+        )
+
+    def tokens(self) -> List[str]:
+        return sorted(self._tokens)
+
 
+def _font_dirs_fingerprint() -> List[List]:
+    """mtimes of the font directories and their direct subdirectories.
+
+    Installing or removing fonts changes at least one of these, which is the
+    same signal fontconfig itself uses to decide whether its cache is stale.
+    """
+    fingerprint = []
+    for root in FONT_SEARCH_DIRS:
+        try:
+            fingerprint.append([str(root), root.stat().st_mtime_ns])
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        fingerprint.append([entry.path, entry.stat().st_mtime_ns])
+        except OSError:
+            continue
+    return sorted(fingerprint)
+
+
+def load_font_index(use_cache: bool = True) -> FontIndex:
+    """Return the font index, reusing the persisted one if no font dir changed."""
+    if use_cache:
+        try:
+            with open(FONT_INDEX_PATH, encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("fingerprint") == _font_dirs_fingerprint():
+                logging.debug("Using cached font index '%s'", FONT_INDEX_PATH)
+                return FontIndex(data.get("families", []))
+        except (OSError, ValueError):
+            pass
 
-def setup_fonts(dry_run: bool = False) -> None:
+    index = FontIndex(get_installed_font_families())
+    index.add_font_files(FONT_DIR)
+    return index
+
+
+def save_font_index(index: FontIndex) -> None:
+    data = {"fingerprint": _font_dirs_fingerprint(), "families": index.tokens()}
+    try:
+        FONT_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = FONT_INDEX_PATH.with_name(FONT_INDEX_PATH.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, FONT_INDEX_PATH)
+    except OSError as exc:
+        logging.debug("Failed to write font index '%s': %s", FONT_INDEX_PATH, exc)
+
+
+class DownloadAsset(NamedTuple):
+    name: str
+    url: str
+    family_hints: Union[List[str], None] = None
+
+
+def create_http_session(pool_size: int = FONT_DOWNLOAD_WORKERS):
+    """Return a requests session with pooled keep-alive connections and retries."""
+    ensure_runtime_environment()
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-    font_zips = [
-        (
-            ["firacode", "fira code"],
-            "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/FiraCode.zip",
-        ),
-        (
-            ["robotomono", "roboto mono"],
-            "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/RobotoMono.zip",
-        ),
-        (
-            ["sourcecodepro", "source code pro", "saucecodepro"],
-            "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/SourceCodePro.zip",
-        ),
-        (
-            ["hack"],
-            "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/Hack.zip",
-        ),
-        (
-            ["meslolgs", "meslo lgs"],
-            "https://github.com/ryanoasis/nerd-fonts/releases/download/v2.3.3/Meslo.zip",
-        ),
-    ]
-    font_files = [
-        "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Regular.ttf",
-        "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Bold.ttf",
-        "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Italic.ttf",
-        "https://github.com/romkatv/powerlevel10k-media/raw/master/MesloLGS%20NF%20Bold%20Italic.ttf",
-    ]
-    # Initial snapshot; during this run we update in-memory hints instead of
-    # repeatedly calling fc-list (which is comparatively expensive).
-    installed_families = set() if dry_run else get_installed_font_families()
 
-    logging.info("Downloading and installing fonts from zip files")
-    for idx, (family_hints, zip_url) in enumerate(font_zips, start=1):
-        if _has_font_family(installed_families, family_hints):
+class DownloadCache:
+    """Content-addressed store for downloaded artifacts.
+
+    Blobs live under blobs/<sha256>, and a small JSON entry per URL under
+    urls/ records the blob hash plus ETag/Last-Modified for revalidation.
+    Every write goes through a temp file and rename, so several hosts can
+    share one cache directory (e.g. over NFS or a container mount). Blob
+    mtimes double as LRU timestamps for size-based eviction.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: int = DOWNLOAD_CACHE_MAX_BYTES,
+        offline: bool = False,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / digest
+
+    def _entry_path(self, url: str) -> Path:
+        return self.root / "urls" / (hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _load_entry(self, url: str) -> Union[dict, None]:
+        try:
+            with open(self._entry_path(url), encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url or not self._blob_path(entry["sha256"]).is_file():
+            return None
+        return entry
+
+    def _write_entry(self, url: str, entry: dict) -> None:
+        entry_path = self._entry_path(url)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=entry_path.parent, delete=False, encoding="utf-8"
+        ) as file:
+            json.dump(entry, file)
+        os.replace(file.name, entry_path)
+
+    def lookup(self, url: str) -> Union[Path, None]:
+        """Return the cached blob for url (and mark it as used), if any."""
+        entry = self._load_entry(url)
+        if entry is None:
+            return None
+        blob = self._blob_path(entry["sha256"])
+        try:
+            os.utime(blob)
+        except FileNotFoundError:
+            # evicted, possibly by another host sharing the cache
+            return None
+        return blob
+
+    def fetch(self, session, url: str) -> Tuple[Path, bool]:
+        """Return (blob path, downloaded) for url.
+
+        Cached entries are revalidated with If-None-Match/If-Modified-Since;
+        in offline mode they are used as is and a miss raises
+        FileNotFoundError.
+        """
+        entry = self._load_entry(url)
+        if self.offline:
+            blob = self.lookup(url) if entry is not None else None
+            if blob is None:
+                raise FileNotFoundError(
+                    f"'{url}' is not in the download cache '{self.root}' (offline mode)"
+                )
+            return blob, False
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with session.get(
+            url, headers=headers, stream=True, allow_redirects=True, timeout=(10, 180)
+        ) as response:
+            if response.status_code != 304 or entry is None:
+                return self._store_response(url, response), True
+            blob = self.lookup(url)
+            if blob is not None:
+                logging.debug("Cached copy of '%s' is still current", url)
+                return blob, False
+
+        logging.debug("Cached copy of '%s' was evicted meanwhile; downloading it", url)
+        with session.get(
+            url, stream=True, allow_redirects=True, timeout=(10, 180)
+        ) as response:
+            return self._store_response(url, response), True
+
+    def _store_response(self, url: str, response) -> Path:
+        """Save a response body as the blob for url; return the blob path."""
+        response.raise_for_status()
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as file:
+            try:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    digest.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                # evict() never looks at tmp/, so a partial file would stay
+                file.close()
+                os.unlink(file.name)
+                raise
+
+        blob = self._blob_path(digest.hexdigest())
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(file.name, blob)
+        self._write_entry(
+            url,
+            {
+                "url": url,
+                "sha256": digest.hexdigest(),
+                "size": size,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            },
+        )
+        self.evict()
+        return blob
+
+    def evict(self) -> None:
+        """Delete least recently used blobs until the cache fits max_bytes."""
+        with self._lock:
+            blobs = []
+            for blob in (self.root / "blobs").glob("*/*"):
+                try:
+                    stat_result = blob.stat()
+                except OSError:
+                    continue
+                blobs.append((stat_result.st_mtime, stat_result.st_size, blob))
+            total = sum(size for _, size, _ in blobs)
+            for _, size, blob in sorted(blobs):
+                if total <= self.max_bytes:
+                    break
+                logging.debug("Evicting '%s' from the download cache", blob)
+                try:
+                    blob.unlink()
+                except OSError:
+                    continue
+                total -= size
+
+
+def _download_asset(session, cache: DownloadCache, asset: DownloadAsset) -> Path:
+    start = time.monotonic()
+    with timed("download: %s" % asset.name):
+        path, downloaded = cache.fetch(session, asset.url)
+    size = path.stat().st_size
+    elapsed = max(time.monotonic() - start, 1e-6)
+    if downloaded:
+        logging.info(
+            "Downloaded %s (%.1f MB in %.1fs, %.1f MB/s)",
+            asset.name,
+            size / 1e6,
+            elapsed,
+            size / 1e6 / elapsed,
+        )
+    else:
+        logging.info("Using cached %s (%.1f MB)", asset.name, size / 1e6)
+    return path
+
+
+def download_assets(
+    assets: List[DownloadAsset],
+    cache: DownloadCache,
+    workers: int = FONT_DOWNLOAD_WORKERS,
+    session=None,
+) -> Iterator[Tuple[DownloadAsset, Path]]:
+    """Fetch assets concurrently and yield (asset, cached file) as each finishes.
+
+    Failed downloads are logged and skipped so the remaining assets still get
+    installed.
+    """
+    if not assets:
+        return
+    workers = max(1, min(workers, len(assets)))
+    if session is None and not cache.offline:
+        session = create_http_session(workers)
+    start = time.monotonic()
+    total_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_download_asset, session, cache, asset): asset
+            for asset in assets
+        }
+        for idx, future in enumerate(as_completed(futures), start=1):
+            asset = futures[future]
+            try:
+                path = future.result()
+            except Exception as exc:
+                logging.error(
+                    "[%d/%d] Failed to download %s: %s",
+                    idx,
+                    len(assets),
+                    asset.url,
+                    exc,
+                )
+                continue
+            total_bytes += path.stat().st_size
+            logging.debug(
+                "[%d/%d] Finished download of %s", idx, len(assets), asset.name
+            )
+            yield asset, path
+    elapsed = max(time.monotonic() - start, 1e-6)
+    logging.info(
+        "Fetched %.1f MB in %.1fs (%.1f MB/s, %d parallel)",
+        total_bytes / 1e6,
+        elapsed,
+        total_bytes / 1e6 / elapsed,
+        workers,
+    )
+
+
+def setup_fonts(
+    cache: DownloadCache,
+    dry_run: bool = False,
+    workers: int = FONT_DOWNLOAD_WORKERS,
+    refresh_font_index: bool = False,
+) -> None:
+    # Built once per run (or loaded from the previous run); during this run
+    # it is updated from our own font directory instead of calling fc-list
+    # again (which is comparatively expensive).
+    font_index = load_font_index(use_cache=not refresh_font_index)
+
+    fonts_written = 0
+    missing_assets: List[DownloadAsset] = []
+    for idx, (family_hints, zip_url) in enumerate(FONT_ZIPS, start=1):
+        if font_index.contains(family_hints):
             logging.info(
                 "[%d/%d] Skipping %s zip (already installed)",
                 idx,
-                len(font_zips),
+                len(FONT_ZIPS),
                 family_hints[0],
             )
             continue
+        missing_assets.append(DownloadAsset(family_hints[0], zip_url, family_hints))
 
-        if dry_run:
-            logging.info(
-                "[%d/%d] Dry-run:: would download and install %s",
-                idx,
-                len(font_zips),
-                zip_url,
-            )
-            continue
-        logging.info("[%d/%d] Downloading %s", idx, len(font_zips), zip_url)
-        request = requests.get(zip_url, allow_redirects=True, timeout=(10, 180))
-        request.raise_for_status()
-        zip_file = zipfile.ZipFile(io.BytesIO(request.content))
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            zip_file.extractall(tmp_dir)
-            copy_fonts_to_directory(Path(tmp_dir), dry_run=dry_run)
-            for family_hint in family_hints:
-                installed_families.add(family_hint.lower())
-
-    logging.info("Downloading and installing individual font files")
-    for idx, file_url in enumerate(font_files, start=1):
+    for idx, file_url in enumerate(FONT_FILES, start=1):
         filename = os.path.basename(unquote(file_url))
-        target_file = HOME_DIR / ".local" / "share" / "fonts" / filename
-        if target_file.exists():
+        if (FONT_DIR / filename).exists():
             logging.info(
                 "[%d/%d] Skipping %s (already installed)",
                 idx,
-                len(font_files),
+                len(FONT_FILES),
                 filename,
             )
             continue
+        missing_assets.append(DownloadAsset(filename, file_url))
+
+    if dry_run:
+        for asset in missing_assets:
+            logging.info("Dry-run:: would download and install %s", asset.url)
+    elif missing_assets:
+        logging.info(
+            "Fetching %d font assets (%d parallel)",
+            len(missing_assets),
+            min(workers, len(missing_assets)),
+        )
+        # Install each asset as soon as its download finishes, while the
+        # remaining downloads are still in flight.
+        for asset, cached_file in download_assets(missing_assets, cache, workers):
+            if asset.family_hints is not None:
+                installed = install_fonts_from_archive(cached_file, dry_run=dry_run)
+                logging.info("Installed %d fonts from %s", installed, asset.name)
+                font_index.add(asset.family_hints)
+            else:
+                installed = copy_fonts_to_directory(
+                    cached_file, dry_run=dry_run, name=asset.name
+                )
+            fonts_written += installed
 
-        if dry_run:
-            logging.info(
-                "[%d/%d] Dry-run:: would download and install %s",
-                idx,
-                len(font_files),
-                filename,
-            )
-            continue
-        logging.info("[%d/%d] Downloading %s", idx, len(font_files), filename)
-        request = requests.get(file_url, allow_redirects=True, timeout=(10, 120))
-        request.raise_for_status()
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            filepath = Path(tmp_dir) / filename
-            with open(filepath, "wb") as file:
-                file.write(request.content)
-            copy_fonts_to_directory(filepath, dry_run=dry_run)
-    command = "fc-cache -f"
-    logging.info("Rebuilding font cache with command: '%s'", command)
     if not dry_run:
-        result = subprocess.run(
-            ["fc-cache", "-f"],
+        font_index.add_font_files(FONT_DIR)
+        save_font_index(font_index)
+    record_summary(
+        "fonts",
+        "%d font files added/replaced, font cache %s"
+        % (fonts_written, rebuild_font_cache(fonts_written, dry_run)),
+    )
+    logging.info(
+        "Remember to configure 'MesloLGS NF' as the default font "
+        + "(see https://github.com/romkatv/powerlevel10k/blob/master/font.md)"
+    )
+
+
+def rebuild_font_cache(fonts_written: int, dry_run: bool = False) -> str:
+    """Refresh the fontconfig cache for FONT_DIR if fonts were written.
+
+    Only our own font directory is rescanned, and without -f: fontconfig
+    notices the changed directory mtime by itself, so there is no need to
+    force a rebuild of every font directory on the system. Returns a short
+    description of what was done for the run summary.
+    """
+    if not fonts_written:
+        logging.info("No fonts were added or replaced; skipping fc-cache")
+        return "untouched"
+    if which("fc-cache") is None:
+        logging.info("fc-cache not found; skipping font cache update")
+        return "not available"
+
+    command = ["fc-cache", str(FONT_DIR)]
+    logging.info("Updating font cache with command: '%s'", " ".join(command))
+    if dry_run:
+        return "would be updated for %s" % FONT_DIR
+    with timed("fc-cache"):
+        result = run_command(
+            command,
             check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding="utf-8",
         )
-        logging.debug(result.stdout)
+    logging.debug(result.stdout)
+    return "updated for %s" % FONT_DIR
+
+
+def _font_member_selected(name: str) -> bool:
+    if any(fnmatch.fnmatch(name, pattern) for pattern in FONT_MEMBER_EXCLUDES):
+        return False
+    if FONT_MEMBER_INCLUDES:
+        return any(fnmatch.fnmatch(name, pattern) for pattern in FONT_MEMBER_INCLUDES)
+    return True
+
+
+def _file_crc32(path: Path) -> int:
+    crc = 0
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _font_already_installed(destination: Path, size: int, crc: int) -> bool:
+    """True if destination holds exactly these bytes (size, then CRC-32)."""
+    try:
+        if destination.stat().st_size != size:
+            return False
+        return _file_crc32(destination) == crc
+    except OSError:
+        return False
+
+
+def _write_font(source: BinaryIO, destination: Path) -> None:
+    # Write next to the destination and rename, so an interrupted install
+    # never leaves a truncated font behind for fontconfig to pick up.
+    with tempfile.NamedTemporaryFile(dir=destination.parent, delete=False) as file:
+        shutil.copyfileobj(source, file, 1 << 20)
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, destination)
+
+
+def install_fonts_from_archive(archive: Path, dry_run: bool = False) -> int:
+    """Install the selected font members of a zip archive into FONT_DIR.
+
+    Members are streamed straight from the archive file into place; non-font
+    files, excluded variants and fonts already present byte-for-byte are
+    skipped without being decompressed. Returns the number of fonts written.
+    """
+    if not dry_run:
+        FONT_DIR.mkdir(parents=True, exist_ok=True)
+    installed = 0
+    with zipfile.ZipFile(archive) as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir():
+                continue
+            name = os.path.basename(info.filename)
+            if Path(name).suffix.lower() not in FONT_SUFFIXES:
+                logging.debug("Skipping non-font file '%s'", info.filename)
+                continue
+            if not _font_member_selected(name):
+                logging.debug("Skipping excluded font variant '%s'", name)
+                continue
+            destination = FONT_DIR / name
+            if _font_already_installed(destination, info.file_size, info.CRC):
+                logging.debug("Skipping identical font '%s'", destination)
+                continue
+            logging.debug("Extracting '%s' to '%s'", info.filename, destination)
+            if not dry_run:
+                with zip_file.open(info) as source:
+                    _write_font(source, destination)
+            installed += 1
+    return installed
+
+
+def copy_fonts_to_directory(
+    source: Path, dry_run: bool = False, name: Union[str, None] = None
+) -> int:
+    """Copy a font file (or all font files of a directory) into FONT_DIR.
+
+    Returns the number of fonts written; identical fonts are skipped.
+    """
+    font_dir = FONT_DIR
+    if not dry_run:
+        font_dir.mkdir(parents=True, exist_ok=True)
+
+    if source.is_file():
+        files = [(source, font_dir / (name or source.name))]
+    else:
+        logging.debug(
+            "Copying all font files from directory '%s' to '%s'", source, font_dir
+        )
+        files = []
+        for file in source.iterdir():
+            if file.suffix.lower() in FONT_SUFFIXES:
+                files.append((file, font_dir / file.name))
+            else:
+                logging.debug("Skipping non-font file '%s'", file)
+
+    installed = 0
+    for file, destination in files:
+        size = file.stat().st_size
+        if _font_already_installed(destination, size, _file_crc32(file)):
+            logging.debug("Skipping identical font '%s'", destination)
+            continue
+        logging.debug("Copying font file '%s' to '%s'", file, destination)
+        if not dry_run:
+            with open(file, "rb") as source_file:
+                _write_font(source_file, destination)
+        installed += 1
+    return installed
+
+
+def _os_release() -> Dict[str, str]:
+    release: Dict[str, str] = {}
+    try:
+        with open("/etc/os-release", "r", encoding="utf-8") as file:
+            for line in file:
+                key, sep, value = line.strip().partition("=")
+                if sep:
+                    release[key] = value.strip('"')
+    except OSError:
+        pass
+    return release
+
+
+def apt_bundle_key(packages: List[str]) -> Union[str, None]:
+    """Name of the bundle for packages on this distro release and architecture."""
+    if which("dpkg") is None:
+        return None
+    result = run_command(["dpkg", "--print-architecture"])
+    if result.returncode != 0:
+        return None
+    release = _os_release()
+    digest = hashlib.sha256("\n".join(sorted(packages)).encode("utf-8")).hexdigest()
+    return "%s-%s-%s-%s" % (
+        release.get("ID", "unknown"),
+        release.get("VERSION_ID", "unknown"),
+        result.stdout.strip(),
+        digest[:12],
+    )
+
+
+def apt_dependency_closure(packages: List[str]) -> List[str]:
+    """Packages that installing packages may need: recursive Depends/PreDepends.
+
+    This includes every alternative of an 'a | b' dependency and every
+    provider of a virtual package, so apt can pick among them on install.
+    """
+    result = run_command(
+        [
+            "apt-cache",
+            "depends",
+            "--recurse",
+            "--no-recommends",
+            "--no-suggests",
+            "--no-conflicts",
+            "--no-breaks",
+            "--no-replaces",
+            "--no-enhances",
+            *packages,
+        ],
+        check=True,
+    )
+    # Package names start in the first column, dependencies are indented and
+    # virtual packages (provided by real ones also listed) are in <angle brackets>.
+    return sorted(
+        {
+            line.strip()
+            for line in result.stdout.splitlines()
+            if line and not line[0].isspace() and not line.startswith("<")
+        }
+    )
+
+
+def build_apt_bundle(
+    packages: List[str], root: Path = APT_BUNDLE_DIR
+) -> Union[Path, None]:
+    """Download the .debs of the dependency closure of packages as a flat apt repository.
+
+    The bundle directory is named by apt_bundle_key(), so containers only use
+    it on the same distro release and architecture it was built for.
+    """
+    key = apt_bundle_key(packages)
+    if key is None or which("apt-cache") is None:
+        logging.error("Building an apt bundle needs dpkg, apt-cache and apt-get")
+        return None
+    index_command = _apt_bundle_index_command()
+    if index_command is None:
+        logging.error(
+            "Building an apt bundle needs apt-ftparchive (apt-utils) or dpkg-scanpackages (dpkg-dev)"
+        )
+        return None
+    if apt_lists_age_hours() > APT_LISTS_MAX_AGE_HOURS:
+        logging.warning(
+            "apt package lists are older than %.0f hours; the bundle may be outdated",
+            APT_LISTS_MAX_AGE_HOURS,
+        )
+
+    try:
+        closure = apt_dependency_closure(packages)
+    except subprocess.CalledProcessError as cpe:
+        logging.error(
+            "Failed to resolve the package dependencies: %s",
+            _format_subprocess_error(cpe),
+        )
+        return None
+    candidates = apt_candidate_versions(closure)
+    downloadable = [pkg for pkg in closure if candidates.get(pkg)]
+    uncovered = [pkg for pkg in packages if pkg not in downloadable]
+    if uncovered:
+        logging.warning(
+            "No install candidate for %s; containers will install them from the network",
+            ", ".join(uncovered),
+        )
     logging.info(
-        "Remember to configure 'MesloLGS NF' as the default font "
-        + "(see https://github.com/romkatv/powerlevel10k/blob/master/font.md)"
+        "Downloading %d packages (closure of %s) into apt bundle '%s'",
+        len(downloadable),
+        ", ".join(packages),
+        key,
     )
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".%s." % key, dir=root))
+    try:
+        run_command(["apt-get", "download", *downloadable], cwd=tmp_dir, check=True)
+        # apt-get download names files <package>_<version>_<arch>.deb
+        debs = {
+            unquote(path.name.split("_", 1)[0]): path.name
+            for path in tmp_dir.glob("*.deb")
+        }
+        manifest = {
+            "key": key,
+            "packages": sorted(packages),
+            "versions": {pkg: candidates[pkg] for pkg in downloadable},
+            "debs": debs,
+        }
+        with open(tmp_dir / "manifest.json", "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        _write_apt_bundle_index(tmp_dir, index_command)
+        bundle_dir = root / key
+        if bundle_dir.exists():
+            shutil.rmtree(bundle_dir)
+        os.replace(tmp_dir, bundle_dir)
+    except subprocess.CalledProcessError as cpe:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        logging.error("Failed to build apt bundle: %s", _format_subprocess_error(cpe))
+        return None
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logging.info("apt bundle ready: '%s' (%d .deb files)", bundle_dir, len(debs))
+    return bundle_dir
+
+
+def _apt_bundle_index_command() -> Union[List[str], None]:
+    """Command printing the Packages index of the .debs in the current directory."""
+    if which("apt-ftparchive") is not None:
+        return ["apt-ftparchive", "packages", "."]
+    if which("dpkg-scanpackages") is not None:
+        return ["dpkg-scanpackages", "--multiversion", "."]
+    return None
+
+
+def _write_apt_bundle_index(bundle_dir: Path, command: List[str]) -> None:
+    """Write the Packages index that makes bundle_dir a flat apt repository."""
+    result = run_command(command, cwd=bundle_dir, check=True)
+    (bundle_dir / "Packages").write_text(result.stdout, encoding="utf-8")
+
+
+def find_apt_bundle(packages: List[str]) -> Union[Path, None]:
+    """Return a bundle built for packages on this distro/arch, if one is mounted."""
+    key = apt_bundle_key(packages)
+    if key is None:
+        return None
+    for root in APT_BUNDLE_SEARCH_DIRS:
+        if (root / key / "manifest.json").is_file() and (
+            root / key / "Packages"
+        ).is_file():
+            return root / key
+    logging.debug("No apt bundle '%s' found", key)
+    return None
+
+
+def install_apt_bundle(bundle_dir: Path, packages: List[str]) -> bool:
+    """Install packages from a bundle without network or the system package lists.
+
+    apt sees the bundle as its only repository and resolves the missing
+    packages against it like it would against the network, so only the
+    dependencies (and alternatives) it actually picks are installed.
+    Returns False if the bundle does not cover the packages.
+    Raises subprocess.CalledProcessError if apt-get fails.
+    """
+    with open(bundle_dir / "manifest.json", "r", encoding="utf-8") as file:
+        debs = json.load(file)["debs"]
+    installed = installed_apt_packages()
+    missing = [pkg for pkg in packages if pkg not in installed]
+    if not missing:
+        logging.info("All zsh packages are already installed. Nothing to do.")
+        return True
+    if any(pkg not in debs for pkg in missing):
+        logging.warning("apt bundle '%s' does not cover %s", bundle_dir, missing)
+        return False
 
+    logging.info("Installing %s from apt bundle '%s'", ", ".join(missing), bundle_dir)
+    with tempfile.TemporaryDirectory(prefix="dotfiles-apt-bundle.") as state_dir:
+        source_list = Path(state_dir) / "bundle.list"
+        source_list.write_text(
+            "deb [trusted=yes] file:%s ./\n" % bundle_dir.resolve(), encoding="utf-8"
+        )
+        lists_dir = Path(state_dir) / "lists"
+        (lists_dir / "partial").mkdir(parents=True)
+        # Replace the configured sources and package lists for these calls only.
+        options = [
+            "-o",
+            "Dir::Etc::SourceList=%s" % source_list,
+            "-o",
+            "Dir::Etc::SourceParts=-",
+            "-o",
+            "Dir::State::Lists=%s" % lists_dir,
+            "-o",
+            "APT::Get::List-Cleanup=0",
+        ]
+        with timed("apt: install bundle"):
+            run_command(_apt_get_command(*options, "update"), check=True)
+            result = run_command(
+                _apt_get_command(
+                    *options, "install", "-y", "--no-install-recommends", *missing
+                ),
+                check=True,
+            )
+    logging.debug(result.stdout)
+    invalidate_apt_package_state()
+    return True
 
-def copy_fonts_to_directory(source: Path, dry_run: bool = False) -> None:
-    font_dir = HOME_DIR / ".local" / "share" / "fonts"
-    if not dry_run:
-        font_dir.mkdir(parents=True, exist_ok=True)
 
-    if source.is_file():
-        destination = font_dir / source.name
-        logging.debug("Moving font file '%s' to '%s'", source, font_dir)
-        if not dry_run:
-            shutil.move(str(source), str(destination))
+def _install_zsh_packages(max_age_hours: float = APT_LISTS_MAX_AGE_HOURS) -> None:
+    """Install zsh dependencies inside the container via apt (idempotent).
+
+    Skips entirely if all packages are already installed. Uses the apt bundle
+    built on the host if there is one for this distro; otherwise installs from
+    the network (the /var/cache/apt/archives/ volume used by alias caches .deb
+    files across --rm runs).
+    """
+    installed = installed_apt_packages()
+    if all(pkg in installed for pkg in APT_ZSH_PACKAGES):
+        logging.info("All zsh packages are already installed. Nothing to do.")
+        return
+    bundle_dir = find_apt_bundle(sorted(APT_ZSH_PACKAGES))
+    if bundle_dir is not None:
+        try:
+            if install_apt_bundle(bundle_dir, sorted(APT_ZSH_PACKAGES)):
+                return
+        except (OSError, ValueError, KeyError) as exc:
+            logging.warning("Unusable apt bundle '%s': %s", bundle_dir, exc)
+        except subprocess.CalledProcessError as exc:
+            logging.warning(
+                "Installing from apt bundle failed, falling back to apt: %s", exc.stderr
+            )
+    try:
+        plan = run_apt_transaction(
+            sorted(APT_ZSH_PACKAGES),
+            dry_run=False,
+            max_age_hours=max_age_hours,
+            install_args=("--no-install-recommends",),
+        )
+    except subprocess.CalledProcessError as exc:
+        logging.warning("Failed to install container zsh packages: %s", exc.stderr)
         return
+    if plan.install:
+        logging.info("Container zsh packages installed successfully")
 
-    logging.debug("Moving all font files from directory '%s' to '%s'", source, font_dir)
-    for file in source.iterdir():
-        if file.suffix in (".ttf", ".otf", ".ttc"):
-            destination = font_dir / file.name
-            logging.debug("Moving file '%s' to '%s'", file, destination)
-            if not dry_run:
-                shutil.move(str(file), str(destination))
-        else:
-            logging.debug("Skipping non-font file '%s'", file)
 
+# Linux FICLONE ioctl (_IOW(0x94, 9, int)): share the source's extents (reflink)
+FICLONE = 0x40049409
+
+
+def _scan_tree(root: Path) -> Dict[str, os.stat_result]:
+    """lstat results of everything below root, keyed by relative path."""
+    entries: Dict[str, os.stat_result] = {}
+    pending = [""]
+    while pending:
+        relative = pending.pop()
+        try:
+            scanner = os.scandir(os.path.join(root, relative))
+        except FileNotFoundError:
+            continue
+        with scanner:
+            for entry in scanner:
+                path = os.path.join(relative, entry.name)
+                stat_result = entry.stat(follow_symlinks=False)
+                entries[path] = stat_result
+                if stat.S_ISDIR(stat_result.st_mode):
+                    pending.append(path)
+    return entries
 
-def _install_zsh_packages() -> None:
-    """Install zsh dependencies inside the container via apt (idempotent).
 
-    Skips entirely if all packages are already installed.
-    The /var/cache/apt/archives/ volume used by alias caches .deb files across --rm runs.
+def _copy_file_contents(source: str, destination: str, unsupported: Set[str]) -> str:
+    """Copy file data, in-kernel where the filesystems allow; return the method.
+
+    Methods that failed once are not tried again for the rest of the sync.
     """
-    missing: list[str] = []
-    for pkg in APT_ZSH_PACKAGES:
-        result = subprocess.run(
-            ["dpkg", "-s", pkg],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-        if result.returncode != 0:
-            missing.append(pkg)
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        if "reflink" not in unsupported:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return "reflink"
+            except OSError:
+                unsupported.add("reflink")
+        if "copy_file_range" not in unsupported and hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                    pass
+                return "copy_file_range"
+            except OSError:
+                unsupported.add("copy_file_range")
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, 1 << 20)
+        return "copy"
+
+
+def sync_tree(source: Path, destination: Path, workers: int = LINK_WORKERS) -> dict:
+    """Make destination an exact copy of source, touching only what changed.
+
+    Files count as unchanged when size and mtime match (mtimes are carried
+    over on copy); changed files are copied to a temporary name and renamed
+    into place, and entries that vanished from source are removed. Files are
+    never hard-linked, so changes on one side cannot leak into the other.
+    """
+    source_entries = _scan_tree(source)
+    destination_entries = _scan_tree(destination)
+    counts = {"copied": 0, "unchanged": 0, "removed": 0, "bytes": 0}
+    methods: Dict[str, int] = {}
+
+    # Children sort after their parent, so reverse order removes them first.
+    for relative in sorted(destination_entries, reverse=True):
+        existing = destination_entries[relative]
+        wanted = source_entries.get(relative)
+        if wanted is not None and stat.S_IFMT(wanted.st_mode) == stat.S_IFMT(
+            existing.st_mode
+        ):
+            continue
+        path = os.path.join(destination, relative)
+        if stat.S_ISDIR(existing.st_mode):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        del destination_entries[relative]
+        counts["removed"] += 1
+
+    destination.mkdir(parents=True, exist_ok=True)
+    to_copy: List[str] = []
+    for relative in sorted(source_entries):
+        wanted = source_entries[relative]
+        existing = destination_entries.get(relative)
+        path = os.path.join(destination, relative)
+        if stat.S_ISDIR(wanted.st_mode):
+            if existing is None:
+                os.mkdir(path, stat.S_IMODE(wanted.st_mode))
+        elif stat.S_ISLNK(wanted.st_mode):
+            link_to = os.readlink(os.path.join(source, relative))
+            if existing is not None and os.readlink(path) == link_to:
+                counts["unchanged"] += 1
+                continue
+            tmp_path = "%s.dotfiles-sync-%d.tmp" % (path, os.getpid())
+            os.symlink(link_to, tmp_path)
+            os.replace(tmp_path, path)
+            counts["copied"] += 1
+        elif stat.S_ISREG(wanted.st_mode):
+            if (
+                existing is not None
+                and existing.st_size == wanted.st_size
+                and existing.st_mtime_ns == wanted.st_mtime_ns
+            ):
+                counts["unchanged"] += 1
+            else:
+                to_copy.append(relative)
 
-    if not missing:
-        logging.info("All container zsh packages already installed")
-        return
+    unsupported: Set[str] = set()
 
-    logging.info("Installing container zsh packages: %s", ", ".join(missing))
-    try:
-        subprocess.run(
-            ["sudo", "apt-get", "update", "-qq"],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding="utf-8",
-        )
-        subprocess.run(
-            ["sudo", "apt-get", "install", "-y", "--no-install-recommends"] + missing,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            encoding="utf-8",
+    def copy_file(relative: str) -> Tuple[str, int]:
+        wanted = source_entries[relative]
+        path = os.path.join(destination, relative)
+        tmp_path = "%s.dotfiles-sync-%d.tmp" % (path, os.getpid())
+        method = _copy_file_contents(
+            os.path.join(source, relative), tmp_path, unsupported
         )
-        logging.info("Container zsh packages installed successfully")
-    except subprocess.CalledProcessError as exc:
-        logging.warning("Failed to install container zsh packages: %s", exc.stderr)
+        os.chmod(tmp_path, stat.S_IMODE(wanted.st_mode))
+        os.utime(tmp_path, ns=(wanted.st_atime_ns, wanted.st_mtime_ns))
+        os.replace(tmp_path, path)
+        return method, wanted.st_size
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for method, size in executor.map(copy_file, to_copy):
+            methods[method] = methods.get(method, 0) + 1
+            counts["copied"] += 1
+            counts["bytes"] += size
 
+    logging.info(
+        "Synced '%s' to '%s': %d copied (%.1f MB%s), %d unchanged, %d removed",
+        source,
+        destination,
+        counts["copied"],
+        counts["bytes"] / 1e6,
+        "".join(", %d via %s" % (n, method) for method, n in sorted(methods.items())),
+        counts["unchanged"],
+        counts["removed"],
+    )
+    return counts
 
-def run_additional_setup_in_container() -> None:
+
+def run_additional_setup_in_container(
+    max_age_hours: float = APT_LISTS_MAX_AGE_HOURS,
+) -> None:
     logging.info("Running additional setup in container")
 
     # 1. Install zsh apt dependencies (idempotent, cached debs)
-    _install_zsh_packages()
+    _install_zsh_packages(max_age_hours)
 
-    # 2. Seed zinit cache from host mount into named volume (first run only)
+    # 2. Sync zinit cache from host mount into named volume (changed files only)
     zinit_cache_path = Path(".local") / "share" / "zinit"
     host_home_mount_path = Path("/mnt/host_home")
     host_zinit_cache = host_home_mount_path / zinit_cache_path
     container_zinit_cache = HOME_DIR / zinit_cache_path
 
-    if host_zinit_cache.exists() and not container_zinit_cache.exists():
-        logging.info(
-            "Copying zinit cache from '%s' to '%s'",
-            host_zinit_cache,
-            container_zinit_cache,
-        )
-        container_zinit_cache.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(host_zinit_cache, container_zinit_cache)
+    if host_zinit_cache.is_dir():
+        with timed("zinit sync"):
+            sync_tree(host_zinit_cache, container_zinit_cache)
     else:
-        logging.debug(
-            "Zinit cache not copied: source exists: %s, destination exists: %s",
-            host_zinit_cache.exists(),
-            container_zinit_cache.exists(),
-        )
+        logging.debug("Zinit cache not synced: '%s' does not exist", host_zinit_cache)
 
     # 3. Run optional extension scripts
     script_path_from_env = os.environ.get("DOTFILES_CONTAINER_EXTENSION_SCRIPT")
@@ -1019,19 +3401,289 @@ def run_additional_setup_in_container() -> None:
             )
             continue
         logging.info("Running additional setup script: %s", script)
-        result = subprocess.run(
+        result = run_command(
             [interpreter, str(script)],
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
         )
         logging.debug(result.stdout)
 
 
+def home_snapshot_key() -> Union[dict, None]:
+    """What a home snapshot depends on: the dotfiles state and host facts.
+
+    None if the checkout is not a git repository, because then two states of
+    the dotfiles cannot be told apart.
+    """
+    commit = git_head_commit()
+    if commit is None:
+        return None
+    dotfiles = sorted(DOTFILES - PATHS_IGNORED_IN_DOCKER)
+    # Uncommitted changes to tracked dotfiles are part of the state too.
+    diff = _run_git(["diff", "HEAD", "--binary", "--", *dotfiles]) or ""
+    return {
+        "commit": commit,
+        "worktree": hashlib.sha256(diff.encode("utf-8")).hexdigest() if diff else None,
+        "user": get_host_facts().user,
+        "home": str(HOME_DIR),
+        # the zinit cache may hold compiled plugins
+        "machine": platform.machine(),
+    }
+
+
+def _snapshot_member(
+    name: str, member_type: bytes, mode: int, mtime: int
+) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.type = member_type
+    info.mode = mode
+    info.mtime = mtime
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info
+
+
+def _compile_zsh_config(sources: Dict[str, Path], work_dir: Path) -> Dict[str, Path]:
+    """zcompile the zsh files among sources in work_dir; return the .zwc files."""
+    names = [
+        name
+        for name in sorted(sources)
+        if name.endswith(".zsh") or os.path.basename(name) in (".zshrc", ".zprofile")
+    ]
+    if not names or which("zsh") is None:
+        logging.info("Not compiling the zsh config (zsh not found)")
+        return {}
+    for name in names:
+        (work_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(sources[name], work_dir / name)
+    result = run_command(
+        ["zsh", "-fc", 'for f; zcompile -U "$f"', "zsh", *names],
+        cwd=work_dir,
+    )
+    if result.returncode != 0:
+        logging.warning("zcompile failed: %s", result.stderr.strip())
+    compiled = {name + ".zwc": work_dir / (name + ".zwc") for name in names}
+    return {name: path for name, path in compiled.items() if path.is_file()}
+
+
+def export_home_snapshot(path: Path) -> None:
+    """Write the set-up home directory as a reproducible tar archive.
+
+    The archive holds the dotfiles as regular files (a container cannot follow
+    links into a checkout it does not mount), the zinit plugin cache, .zwc
+    files of the zsh config and, as its first member, a manifest with the
+    home_snapshot_key(). Members are sorted, owned by root and dated to the
+    commit, so the same state always gives the same bytes. A '.gz' suffix
+    compresses the archive.
+    """
+    key = home_snapshot_key()
+    if key is None:
+        logging.error("A home snapshot needs the dotfiles to be a git checkout")
+        sys.exit(1)
+    commit_time = int(_run_git(["show", "-s", "--format=%ct", "HEAD"]) or 0)
+
+    # name -> (member, file with its content)
+    members: Dict[str, Tuple[tarfile.TarInfo, Union[Path, None]]] = {}
+    dotfiles: Dict[str, Path] = {}
+    for target, source in enumerate_dotfile_links(
+        sorted(DOTFILES - PATHS_IGNORED_IN_DOCKER)
+    ):
+        if not source.is_file():
+            continue
+        name = target.relative_to(HOME_DIR).as_posix()
+        dotfiles[name] = source
+        mode = 0o755 if os.access(source, os.X_OK) else 0o644
+        members[name] = (
+            _snapshot_member(name, tarfile.REGTYPE, mode, commit_time),
+            source,
+        )
+
+    zinit_dir = HOME_DIR / ".local" / "share" / "zinit"
+    zinit_prefix = zinit_dir.relative_to(HOME_DIR).as_posix()
+    zinit_entries = _scan_tree(zinit_dir)
+    for relative, stat_result in zinit_entries.items():
+        name = "%s/%s" % (zinit_prefix, Path(relative).as_posix())
+        mode = stat.S_IMODE(stat_result.st_mode)
+        mtime = int(stat_result.st_mtime)
+        if stat.S_ISDIR(stat_result.st_mode):
+            members[name] = (_snapshot_member(name, tarfile.DIRTYPE, mode, mtime), None)
+        elif stat.S_ISREG(stat_result.st_mode):
+            member = _snapshot_member(name, tarfile.REGTYPE, mode, mtime)
+            members[name] = (member, zinit_dir / relative)
+        elif stat.S_ISLNK(stat_result.st_mode):
+            member = _snapshot_member(name, tarfile.SYMTYPE, 0o777, mtime)
+            member.linkname = os.readlink(zinit_dir / relative)
+            members[name] = (member, None)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        compiled = _compile_zsh_config(dotfiles, Path(work_dir))
+        for name, zwc in compiled.items():
+            # zsh only loads a .zwc that is newer than its source
+            member = _snapshot_member(name, tarfile.REGTYPE, 0o644, commit_time + 1)
+            members[name] = (member, zwc)
+
+        for name in list(members):
+            parent = os.path.dirname(name)
+            while parent and parent not in members:
+                member = _snapshot_member(parent, tarfile.DIRTYPE, 0o755, commit_time)
+                members[parent] = (member, None)
+                parent = os.path.dirname(parent)
+
+        manifest = json.dumps(
+            {
+                "version": HOME_SNAPSHOT_VERSION,
+                "key": key,
+                "dotfiles": len(dotfiles),
+                "zinit_entries": len(zinit_entries),
+                "compiled": sorted(compiled),
+            },
+            indent=2,
+            sort_keys=True,
+        ).encode("utf-8")
+        manifest_member = _snapshot_member(
+            HOME_SNAPSHOT_MANIFEST, tarfile.REGTYPE, 0o644, commit_time
+        )
+        manifest_member.size = len(manifest)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(".%s.tmp" % path.name)
+        with open(tmp_path, "wb") as raw:
+            # no name or timestamp in the gzip header, to stay reproducible
+            output = (
+                gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0)
+                if path.suffix == ".gz"
+                else raw
+            )
+            with tarfile.open(
+                fileobj=output, mode="w", format=tarfile.PAX_FORMAT
+            ) as archive:
+                archive.addfile(manifest_member, io.BytesIO(manifest))
+                for name in sorted(members):
+                    member, source = members[name]
+                    if source is None:
+                        archive.addfile(member)
+                        continue
+                    with open(source, "rb") as file:
+                        member.size = os.fstat(file.fileno()).st_size
+                        archive.addfile(member, file)
+            if output is not raw:
+                output.close()
+        os.replace(tmp_path, path)
+    logging.info(
+        "Exported home snapshot of %s (%d dotfiles, %d zinit entries, %d compiled) to '%s'",
+        key["commit"][:12],
+        len(dotfiles),
+        len(zinit_entries),
+        len(compiled),
+        path,
+    )
+
+
+def _read_snapshot_manifest(file: BinaryIO) -> Union[dict, None]:
+    try:
+        manifest = json.load(file)
+    except ValueError:
+        return None
+    if (
+        not isinstance(manifest, dict)
+        or manifest.get("version") != HOME_SNAPSHOT_VERSION
+    ):
+        return None
+    return manifest
+
+
+def _prepare_snapshot_target(
+    target: Path, is_dir: bool, backups: Union[BackupStore, None]
+) -> None:
+    """Clear the way for a snapshot member without writing through links.
+
+    The home may still hold links into a host mount from an earlier run.
+    Real files and directories are saved to backups first, like the link
+    phase does.
+    """
+    replaced = target.exists() and not target.is_symlink()
+    if replaced and backups is not None and (not is_dir or not target.is_dir()):
+        _backup_target(target, dry_run=False, backups=backups)
+    if target.is_symlink() or (target.exists() and not target.is_dir()):
+        target.unlink()
+    elif target.is_dir() and not is_dir:
+        shutil.rmtree(target)
+
+
+def apply_home_snapshot(
+    path: Path, backup: bool = True, backup_keep: int = BACKUP_KEEP_RUNS
+) -> bool:
+    """Unpack a home snapshot made by export_home_snapshot() into HOME_DIR.
+
+    Returns True if the home matches the current dotfiles afterwards, i.e. the
+    snapshot was applied now or earlier (for example baked into the image),
+    and False if there is no snapshot for this state. Files it replaces are
+    backed up, except in the zinit cache.
+    Raises tarfile.TarError, OSError, EOFError or ValueError for a broken
+    archive; the home may then be partly unpacked.
+    """
+    key = home_snapshot_key()
+    if key is None:
+        return False
+    applied_path = HOME_DIR / HOME_SNAPSHOT_MANIFEST
+    if applied_path.is_file() and not applied_path.is_symlink():
+        with open(applied_path, "rb") as file:
+            applied = _read_snapshot_manifest(file)
+        if applied is not None and applied["key"] == key:
+            logging.info("Home snapshot for %s is already in place", key["commit"][:12])
+            return True
+    if not path.is_file():
+        logging.debug("No home snapshot at '%s'", path)
+        return False
+
+    extract_args = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    # Read as a stream: the archive is unpacked in one sequential pass.
+    with tarfile.open(path, mode="r|*") as archive:
+        first = archive.next()
+        if first is None or first.name != HOME_SNAPSHOT_MANIFEST:
+            logging.warning("'%s' is not a home snapshot", path)
+            return False
+        manifest_file = archive.extractfile(first)
+        manifest = _read_snapshot_manifest(manifest_file) if manifest_file else None
+        if manifest is None or manifest["key"] != key:
+            logging.info(
+                "Home snapshot '%s' does not match the dotfiles; running setup", path
+            )
+            return False
+        # From here on the home no longer matches any snapshot until the
+        # unpack completes.
+        applied_path.unlink(missing_ok=True)
+        backups = BackupStore(BACKUP_ROOT, BACKUP_RUN) if backup else None
+        zinit_prefix = (Path(".local") / "share" / "zinit").as_posix() + "/"
+        count = 0
+        try:
+            member = archive.next()
+            while member is not None:
+                if member.name.startswith("/") or ".." in Path(member.name).parts:
+                    raise ValueError("Unsafe path in home snapshot: %s" % member.name)
+                _prepare_snapshot_target(
+                    HOME_DIR / member.name,
+                    member.isdir(),
+                    None if member.name.startswith(zinit_prefix) else backups,
+                )
+                # files belong to whoever unpacks them, not to the exporting host
+                member.uid, member.gid = os.getuid(), os.getgid()
+                member.uname = member.gname = ""
+                archive.extract(member, HOME_DIR, **extract_args)
+                count += 1
+                member = archive.next()
+        finally:
+            if backups is not None:
+                finish_backup_run(backups, backup_keep)
+    # Only reached after a complete unpack (errors propagate above), so an
+    # interrupted or failed unpack is never taken as applied.
+    applied_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    logging.info("Applied home snapshot of %s (%d entries)", key["commit"][:12], count)
+    return True
+
+
 def setup_update_timer(dry_run: bool = False) -> None:
     timer_unit = "dotfiles-update-check.timer"
-    if shutil.which("systemctl") is None:
+    if not get_host_facts().has_systemctl:
         logging.info("systemctl not found. Skipping timer setup.")
         return
 
@@ -1046,13 +3698,11 @@ def setup_update_timer(dry_run: bool = False) -> None:
             logging.debug("Dry-run:: %s", command_str)
             continue
         try:
-            subprocess.run(
-                command,
-                check=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                encoding="utf-8",
-            )
+            with timed(command_str):
+                run_command(
+                    command,
+                    check=True,
+                )
         except subprocess.CalledProcessError as cpe:
             logging.warning(
                 "Failed to run '%s'. Timer setup skipped for now: %s",
@@ -1062,14 +3712,45 @@ def setup_update_timer(dry_run: bool = False) -> None:
             return
 
 
-def install_starship(dry_run: bool = False) -> None:
-    if shutil.which("starship") is not None:
+def install_starship(cache: DownloadCache, dry_run: bool = False) -> None:
+    if which("starship") is not None:
         logging.info("starship is already installed")
         return
 
+    bin_dir = HOME_DIR / ".local" / "bin"
+    archive_name = STARSHIP_ARCHIVES.get(platform.machine())
+    if archive_name is None:
+        # No prebuilt musl archive for this machine; let the upstream
+        # installer figure it out (uncached, needs network).
+        _install_starship_with_script(bin_dir, dry_run)
+        return
+
+    url = f"{STARSHIP_RELEASE_URL}/{archive_name}"
+    logging.info("Installing starship from %s", url)
+    if dry_run:
+        logging.debug("Dry-run:: would install starship from %s to %s", url, bin_dir)
+        return
+
+    try:
+        session = None if cache.offline else create_http_session(1)
+        archive = _download_asset(session, cache, DownloadAsset("starship", url))
+        with tarfile.open(archive) as tar:
+            member = tar.getmember("starship")
+            source = tar.extractfile(member)
+            bin_dir.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=bin_dir, delete=False) as file:
+                shutil.copyfileobj(source, file)
+        os.chmod(file.name, 0o755)
+        os.replace(file.name, bin_dir / "starship")
+        logging.info("starship installed successfully")
+    except Exception as exc:
+        logging.warning("Failed to install starship: %s", exc)
+
+
+def _install_starship_with_script(bin_dir: Path, dry_run: bool) -> None:
     install_command = (
         "curl -fsSL https://starship.rs/install.sh | sh -s -- -y "
-        f"--bin-dir {HOME_DIR / '.local' / 'bin'}"
+        f"--bin-dir {bin_dir}"
     )
     logging.info("Installing starship")
     logging.debug("Running command: %s", install_command)
@@ -1078,13 +3759,10 @@ def install_starship(dry_run: bool = False) -> None:
         return
 
     try:
-        subprocess.run(
+        run_command(
             install_command,
             check=True,
             shell=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
         )
         logging.info("starship installed successfully")
     except subprocess.CalledProcessError as cpe:
@@ -1095,36 +3773,92 @@ def is_running_in_docker() -> bool:
     return Path("/.dockerenv").is_file()
 
 
-def has_ui_environment() -> bool:
-    """Detect if the system has a UI environment (X11, Wayland, or GNOME)"""
-    # Check for DISPLAY environment variable (X11)
-    if os.environ.get("DISPLAY"):
-        return True
+def active_display_managers(has_systemctl: bool) -> List[str]:
+    """Return the running display managers, asking systemd once for all of them."""
+    if not has_systemctl:
+        return []
+    result = run_command(["systemctl", "is-active", *DISPLAY_MANAGERS])
+    # One state per unit, in argument order ("active", "inactive", ...)
+    states = result.stdout.split()
+    return [dm for dm, state in zip(DISPLAY_MANAGERS, states) if state == "active"]
+
+
+class HostFacts(NamedTuple):
+    """What this run needs to know about the host, probed once."""
+
+    in_container: bool
+    ui_session: bool
+    gnome_shell: bool
+    display_managers: List[str]
+    previous_installation: bool
+    has_apt: bool
+    has_systemctl: bool
+    user: str
+
+    @property
+    def has_ui(self) -> bool:
+        """X11/Wayland session, GNOME installed or a display manager running."""
+        return self.ui_session or self.gnome_shell or bool(self.display_managers)
+
+
+_host_facts: Union[HostFacts, None] = None
+
+
+def probe_host_facts() -> HostFacts:
+    has_systemctl = which("systemctl") is not None
+    return HostFacts(
+        in_container=is_running_in_docker(),
+        ui_session=bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")),
+        gnome_shell=which("gnome-shell") is not None,
+        display_managers=active_display_managers(has_systemctl),
+        previous_installation=has_previous_installation(),
+        has_apt=which("apt-get") is not None,
+        has_systemctl=has_systemctl,
+        user=getpass.getuser(),
+    )
 
-    # Check for Wayland
-    if os.environ.get("WAYLAND_DISPLAY"):
-        return True
 
-    # Check if GNOME is installed
-    result = subprocess.run(
-        ["which", "gnome-shell"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    if result.returncode == 0:
-        return True
+def _load_cached_host_facts(max_age_seconds: float) -> Union[HostFacts, None]:
+    try:
+        if time.time() - HOST_FACTS_PATH.stat().st_mtime > max_age_seconds:
+            return None
+        with open(HOST_FACTS_PATH, "r", encoding="utf-8") as file:
+            return HostFacts(**json.load(file))
+    except (OSError, ValueError, TypeError):
+        return None
 
-    # Check for other display managers
-    for dm in ["gdm", "gdm3", "lightdm", "sddm"]:
-        result = subprocess.run(
-            ["systemctl", "is-active", dm],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if result.returncode == 0:
-            return True
 
-    return False
+def _save_host_facts(facts: HostFacts) -> None:
+    try:
+        HOST_FACTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = HOST_FACTS_PATH.with_name(HOST_FACTS_PATH.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(facts._asdict(), file, indent=2)
+        os.replace(tmp_path, HOST_FACTS_PATH)
+    except OSError as exc:
+        logging.debug("Failed to write host facts '%s': %s", HOST_FACTS_PATH, exc)
+
+
+def get_host_facts(max_age_seconds: float = 0) -> HostFacts:
+    """Return the host facts of this run, probing them on first use.
+
+    With max_age_seconds > 0 facts probed by an earlier run are reused from
+    HOST_FACTS_PATH while they are younger than that (for timer-driven runs).
+    """
+    global _host_facts
+    if _host_facts is not None:
+        return _host_facts
+    facts = _load_cached_host_facts(max_age_seconds) if max_age_seconds > 0 else None
+    if facts is not None:
+        logging.debug("Using cached host facts '%s'", HOST_FACTS_PATH)
+    else:
+        with timed("host facts"):
+            facts = probe_host_facts()
+        if max_age_seconds > 0:
+            _save_host_facts(facts)
+    logging.debug("Host facts: %s", facts)
+    _host_facts = facts
+    return facts
 
 
 def has_previous_installation() -> bool:
@@ -1198,6 +3932,23 @@ def parse_arguments():
         action="store_true",
         help="Install UI-dependent packages",
     )
+    parser.add_argument(
+        "--build-apt-bundle",
+        action="store_true",
+        help="Download the zsh packages with all dependencies for offline container installs and exit",
+    )
+    parser.add_argument(
+        "--restore",
+        metavar="RUN",
+        help="Restore the files backed up by RUN (a run id, or 'latest') and exit",
+    )
+    parser.add_argument(
+        "--backup-keep",
+        type=int,
+        default=BACKUP_KEEP_RUNS,
+        metavar="N",
+        help="Keep backups of the last N runs (default: %(default)s)",
+    )
     parser.add_argument(
         "--no-backup",
         action="store_true",
@@ -1224,11 +3975,123 @@ def parse_arguments():
         action="store_true",
         help="Disable interactive prompts and use safe defaults",
     )
+    parser.add_argument(
+        "--verify-links",
+        action="store_true",
+        help="Check every link target instead of trusting the link manifest",
+    )
+    parser.add_argument(
+        "--no-git-index",
+        action="store_true",
+        help="Walk the repository directories instead of using the git index",
+    )
+    parser.add_argument(
+        "--apt-max-age",
+        type=float,
+        default=APT_LISTS_MAX_AGE_HOURS,
+        metavar="HOURS",
+        help="Refresh apt package lists before installing only if older than this "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=FONT_DOWNLOAD_WORKERS,
+        metavar="N",
+        help="Number of parallel font downloads (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--refresh-font-index",
+        action="store_true",
+        help="Ignore the cached font index and query fc-list again",
+    )
+    parser.add_argument(
+        "--font-variant",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="Only install font files matching GLOB from font archives "
+        "(repeatable, e.g. '*Regular*')",
+    )
+    parser.add_argument(
+        "--download-cache",
+        type=Path,
+        default=DOWNLOAD_CACHE_DIR,
+        metavar="DIR",
+        help="Directory for cached downloads, may be shared between hosts "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--download-cache-size",
+        type=int,
+        default=DOWNLOAD_CACHE_MAX_BYTES >> 20,
+        metavar="MB",
+        help="Evict least recently used downloads above this size (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Install fonts and starship only from the download cache",
+    )
+    parser.add_argument(
+        "--build-wheelhouse",
+        type=Path,
+        metavar="DIR",
+        help="Download hash-pinned wheels for the installer venv into DIR and exit "
+        "(use via DOTFILES_INSTALLER_WHEELHOUSE=DIR or a bundled wheelhouse/ dir)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=PHASE_WORKERS,
+        metavar="N",
+        help="Run up to N independent setup phases at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--host-facts-ttl",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Reuse host facts (container, UI, apt/systemctl, ...) probed by a run at most SECONDS ago",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        metavar="FILE",
+        help="Record every external command (argv, cwd, duration, exit code, output) as JSON to FILE",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        metavar="FILE",
+        help="Serve external commands from a trace recorded with --trace instead of running them",
+    )
+    parser.add_argument(
+        "--timings",
+        type=Path,
+        metavar="FILE",
+        help="Write per-phase and per-step timings as JSON to FILE",
+    )
     parser.add_argument(
         "--update",
         action="store_true",
         help="Run update workflow (non-interactive relink, skip host/UI provisioning)",
     )
+    parser.add_argument(
+        "--export-snapshot",
+        type=Path,
+        metavar="FILE",
+        help="Write the set-up home (dotfiles, zinit cache, compiled zsh config) as a tar archive "
+        "for containers and exit",
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=Path,
+        default=HOME_SNAPSHOT_PATH,
+        metavar="FILE",
+        help="Home snapshot that containers unpack instead of running the setup (default: %(default)s)",
+    )
     return parser.parse_args()
 
 
@@ -1239,28 +4102,19 @@ def set_dotfiles_git_user_config(dry_run: bool = False) -> None:
         return
 
     try:
-        subprocess.run(
+        run_command(
             ["git", "config", "--local", "user.name", "Christian Ditscher"],
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
             cwd=SCRIPT_DIR,
         )
-        subprocess.run(
+        run_command(
             ["git", "config", "--local", "user.email", "chris@ditscher.me"],
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
             cwd=SCRIPT_DIR,
         )
-        subprocess.run(
+        run_command(
             ["git", "config", "--local", "commit.gpgsign", "false"],
             check=True,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            encoding="utf-8",
             cwd=SCRIPT_DIR,
         )
         logging.info("Git user configuration set successfully")
@@ -1269,6 +4123,124 @@ def set_dotfiles_git_user_config(dry_run: bool = False) -> None:
         sys.exit(1)
 
 
+# Failure policies for installer phases: "abort" stops scheduling further
+# phases and fails the run, "continue" only skips the phases that depend on
+# the failed one.
+PHASE_ABORT = "abort"
+PHASE_CONTINUE = "continue"
+PHASE_WORKERS = 4
+
+
+class Phase(NamedTuple):
+    name: str
+    run: Callable[[], None]
+    depends_on: Tuple[str, ...] = ()
+    on_failure: str = PHASE_ABORT
+
+
+def _run_timed_phase(phase: Phase) -> None:
+    with timed(phase.name, kind="phase"):
+        phase.run()
+
+
+def run_phases(phases: List[Phase], workers: int = PHASE_WORKERS) -> bool:
+    """Run phases as a dependency graph, independent ones concurrently.
+
+    Dependencies on phases that are not part of the list are ignored.
+    Returns False if a phase with the "abort" policy failed.
+    """
+    pending = {phase.name: phase for phase in phases}
+    done: Set[str] = set()
+    failed: Set[str] = set()
+    aborted = False
+
+    def ready(phase: Phase) -> bool:
+        return all(dep in done or dep not in names for dep in phase.depends_on)
+
+    def blocked(phase: Phase) -> bool:
+        return any(dep in failed for dep in phase.depends_on)
+
+    names = set(pending)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        running: Dict[Future, Phase] = {}
+        while pending or running:
+            for phase in list(pending.values()):
+                if aborted or blocked(phase):
+                    del pending[phase.name]
+                    failed.add(phase.name)
+                    logging.warning("Skipping phase '%s'", phase.name)
+                    record_summary(phase.name, "skipped")
+                elif ready(phase):
+                    del pending[phase.name]
+                    logging.debug("Starting phase '%s'", phase.name)
+                    running[executor.submit(_run_timed_phase, phase)] = phase
+            if not running:
+                if pending:
+                    # Only possible with a dependency cycle.
+                    logging.error(
+                        "Unresolvable phase dependencies: %s",
+                        ", ".join(sorted(pending)),
+                    )
+                    return False
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                phase = running.pop(future)
+                try:
+                    future.result()
+                except (Exception, SystemExit) as exc:
+                    failed.add(phase.name)
+                    record_summary(phase.name, "failed")
+                    if phase.on_failure == PHASE_ABORT:
+                        logging.error("Phase '%s' failed: %s", phase.name, exc)
+                        aborted = True
+                    else:
+                        logging.warning(
+                            "Phase '%s' failed, continuing: %s", phase.name, exc
+                        )
+                    continue
+                done.add(phase.name)
+                logging.debug("Finished phase '%s'", phase.name)
+    return not aborted
+
+
+# Short per-phase results ("what was actually done"), logged at the end of a run.
+RUN_SUMMARY: Dict[str, str] = {}
+
+
+def record_summary(phase: str, result: str) -> None:
+    RUN_SUMMARY[phase] = result
+
+
+def log_run_summary() -> None:
+    for phase, result in RUN_SUMMARY.items():
+        logging.info("Summary: %s: %s", phase, result)
+
+
+def log_timings(total_seconds: float) -> None:
+    with _timings_lock:
+        timings = sorted(TIMINGS, key=lambda entry: entry["seconds"], reverse=True)
+    for entry in timings:
+        logging.info(
+            "Timing: %7.2fs  %-5s  %s", entry["seconds"], entry["kind"], entry["name"]
+        )
+    logging.info("Timing: %7.2fs  total", total_seconds)
+
+
+def write_timings(path: Path, total_seconds: float) -> None:
+    with _timings_lock:
+        timings = sorted(TIMINGS, key=lambda entry: entry["start"])
+    data = {"total_seconds": total_seconds, "timings": timings}
+    try:
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=2)
+    except OSError as exc:
+        logging.warning("Failed to write timings to '%s': %s", path, exc)
+        return
+    logging.info("Wrote timings to '%s'", path)
+
+
 class PrefixFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         if record.levelno >= logging.ERROR:
@@ -1278,9 +4250,92 @@ class PrefixFormatter(logging.Formatter):
         return super().format(record)
 
 
-def main() -> None:
-    ensure_runtime_environment()
+def build_setup_phases(args: argparse.Namespace, facts: HostFacts) -> List[Phase]:
+    phases = [
+        Phase(
+            "links",
+            lambda: setup_dotfile_links(
+                use_symlink=True,
+                backup=not args.no_backup,
+                dry_run=args.dry_run,
+                force=args.force,
+                verify=args.verify_links,
+                use_git_index=not args.no_git_index,
+                backup_keep=args.backup_keep,
+            ),
+        )
+    ]
+
+    if args.update or args.new_host:
+        FONT_MEMBER_INCLUDES.extend(args.font_variant)
+        download_cache = DownloadCache(
+            args.download_cache,
+            max_bytes=args.download_cache_size << 20,
+            offline=args.offline,
+        )
+        phases += [
+            # Keep update runs in sync with prior update behavior.
+            Phase(
+                "apt",
+                lambda: install_apt_packages(
+                    dry_run=args.dry_run, ui=False, max_age_hours=args.apt_max_age
+                ),
+            ),
+            Phase(
+                "fonts",
+                lambda: setup_fonts(
+                    download_cache,
+                    dry_run=args.dry_run,
+                    workers=args.download_workers,
+                    refresh_font_index=args.refresh_font_index,
+                ),
+                # the venv bootstrap behind the HTTP session may run apt-get,
+                # which would wait for the dpkg lock held by the apt phase
+                depends_on=("apt",),
+                on_failure=PHASE_CONTINUE,
+            ),
+            Phase(
+                "starship",
+                lambda: install_starship(download_cache, dry_run=args.dry_run),
+                depends_on=("apt",),
+                on_failure=PHASE_CONTINUE,
+            ),
+            Phase(
+                "git-config",
+                lambda: set_dotfiles_git_user_config(dry_run=args.dry_run),
+                # git is one of the apt packages
+                depends_on=("apt",),
+            ),
+        ]
 
+    if facts.in_container:
+        phases.append(
+            Phase(
+                "container-setup",
+                lambda: run_additional_setup_in_container(
+                    max_age_hours=args.apt_max_age
+                ),
+                # apt holds a lock, so never run both package phases at once
+                depends_on=("links", "apt"),
+                on_failure=PHASE_CONTINUE,
+            )
+        )
+    else:
+        # schedule regular update checks via systemd timer on host (no-op in container)
+        phases.append(
+            Phase(
+                "update-timer",
+                lambda: setup_update_timer(dry_run=args.dry_run),
+                # the timer units are installed by the links phase
+                depends_on=("links",),
+                on_failure=PHASE_CONTINUE,
+            )
+        )
+    return phases
+
+
+def main() -> None:
+    run_start = time.monotonic()
     args = parse_arguments()
     log_format = "%(asctime)s %(levelname)s: %(message)s"
     log_level = logging.DEBUG if args.debug else logging.INFO
@@ -1288,6 +4343,27 @@ def main() -> None:
     handler.setFormatter(PrefixFormatter(log_format))
     logging.basicConfig(level=log_level, handlers=[handler])
 
+    if args.replay:
+        COMMANDS.load_replay(args.replay)
+        logging.info("Replaying external commands from '%s'", args.replay)
+
+    if args.build_wheelhouse:
+        build_wheelhouse(args.build_wheelhouse)
+        return
+
+    if args.build_apt_bundle:
+        if build_apt_bundle(sorted(APT_ZSH_PACKAGES)) is None:
+            sys.exit(1)
+        return
+
+    if args.export_snapshot:
+        export_home_snapshot(args.export_snapshot)
+        return
+
+    if args.restore:
+        restore_backup(args.restore, dry_run=args.dry_run)
+        return
+
     verify_dotfiles_exist()
 
     if args.dry_run:
@@ -1304,47 +4380,63 @@ def main() -> None:
         )
         args.new_host = True
 
-    setup_dotfile_links(
-        use_symlink=True,
-        backup=not args.no_backup,
-        dry_run=args.dry_run,
-        force=args.force,
-    )
-
-    # Auto-detect and prompt if no previous installation and not explicitly set
-    if not any([args.update, is_running_in_docker(), args.non_interactive]):
-        if not args.new_host and not has_previous_installation():
-            logging.info("No previous dotfiles installation detected")
-            args.new_host = prompt_new_host_setup()
-        if args.new_host and not args.ui and has_ui_environment():
-            args.ui = prompt_ui_setup()
-
+    # Settle all interactive decisions before any phase starts, so that
+    # prompts see the state from before this run's links were created.
+    facts = get_host_facts(max_age_seconds=args.host_facts_ttl)
+    # Container starts are never interactive.
+    interactive = not (args.non_interactive or facts.in_container)
     if not args.update:
-        if not args.new_host and not has_previous_installation():
+        if not args.new_host and not facts.previous_installation:
             logging.info("No previous dotfiles installation detected")
-            if args.non_interactive:
+            if not interactive:
                 logging.info("Non-interactive mode: skipping new host prompt")
             else:
                 args.new_host = prompt_new_host_setup()
 
-        if args.new_host and not args.ui and has_ui_environment():
-            if args.non_interactive:
+        if args.new_host and not args.ui and facts.has_ui:
+            if not interactive:
                 logging.info("Non-interactive mode: skipping UI setup prompt")
             else:
                 args.ui = prompt_ui_setup()
 
-    if args.update or args.new_host:
-        # Keep update runs in sync with prior update behavior.
-        install_apt_packages(dry_run=args.dry_run, ui=False)
-        setup_fonts(dry_run=args.dry_run)
-        install_starship(dry_run=args.dry_run)
-        set_dotfiles_git_user_config(dry_run=args.dry_run)
-
-    if is_running_in_docker():
-        run_additional_setup_in_container()
+    snapshot_applied = False
+    if facts.in_container and not args.dry_run:
+        try:
+            snapshot_applied = apply_home_snapshot(
+                args.snapshot, backup=not args.no_backup, backup_keep=args.backup_keep
+            )
+        except (tarfile.TarError, OSError, EOFError, ValueError) as exc:
+            logging.warning(
+                "Could not apply home snapshot '%s', running setup instead: %s",
+                args.snapshot,
+                exc,
+            )
+    if snapshot_applied:
+        # The zinit cache is still synced: plugin updates on the host are not
+        # part of the snapshot key, and an unchanged cache syncs cheaply.
+        phases = [
+            Phase(
+                "container-setup",
+                lambda: run_additional_setup_in_container(
+                    max_age_hours=args.apt_max_age
+                ),
+                on_failure=PHASE_CONTINUE,
+            )
+        ]
     else:
-        # schedule regular update checks via systemd timer on host (no-op in container)
-        setup_update_timer(dry_run=args.dry_run)
+        phases = build_setup_phases(args, facts)
+
+    succeeded = run_phases(phases, workers=args.jobs)
+    total_seconds = time.monotonic() - run_start
+    log_run_summary()
+    log_timings(total_seconds)
+    if args.timings:
+        write_timings(args.timings, total_seconds)
+    if args.trace:
+        COMMANDS.write_trace(args.trace)
+    if not succeeded:
+        logging.error("Setup failed")
+        sys.exit(1)
 
     logging.info("Setup completed successfully")
 